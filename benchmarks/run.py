@@ -0,0 +1,225 @@
+'''
+Times every reader and every riddle generator stage on synthetic resources
+of several sizes, and compares the results against a saved baseline.
+
+    python -m benchmarks.run run --scales 1000 10000 -o baseline.json
+    python -m benchmarks.run compare baseline.json current.json
+'''
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from seco.methods.antonym_riddle import AntonymRiddleGenerator
+from seco.profiling import max_rss_mb
+from seco.readers import (LIWC, AgglutLex, CompactMorphoBR, FrequencyLexicon,
+                          LexicalBase, MorphoBR)
+from seco.readers.store import (ResourceStore, StoreFrequencyLexicon,
+                                StoreLexicalBase, StoreMorphoBR)
+
+from .synthetic import write_resources
+
+
+def traced_peak_mb(func) -> float:
+    '''
+    Peak of the memory allocated while running `func`, traced with
+    `tracemalloc`.
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def measure(results: dict, name: str, func, rows):
+    '''
+    Runs `func`, recording its wall and CPU time, the process peak RSS after
+    it, and the rate of rows it processed (`rows` of its result) in
+    `results`. Tracing memory slows Python allocations down, so `func` is
+    timed untraced, and then run again under `tracemalloc` to record the
+    peak of the memory it allocates.
+    '''
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    n_rows = rows(result)
+    peak = traced_peak_mb(func)
+    results[name] = {'wall_s': wall,
+                     'cpu_s': cpu,
+                     'peak_memory_mb': peak,
+                     'max_rss_mb': max_rss_mb(),
+                     'rows': n_rows,
+                     'rows_per_s': n_rows / wall if wall > 0 else None}
+    return result
+
+
+def benchmark_scale(n_terms: int, seed: int = 0) -> dict:
+    '''
+    Benchmarks the readers and generator stages with `n_terms` synthetic
+    agglutinated terms.
+    '''
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = write_resources(Path(tmpdir), n_terms, seed)
+
+        agglutlex = measure(results, 'AgglutLex.read',
+                            lambda: AgglutLex.read(paths['AgglutLex']),
+                            lambda r: r.data.shape[0])
+        freqlex = measure(results, 'FrequencyLexicon.read',
+                          lambda: FrequencyLexicon.read(
+                              paths['FrequencyLexicon']),
+                          lambda r: r.counts.shape[0])
+        lexbase = measure(results, 'LexicalBase.read',
+                          lambda: LexicalBase.read(paths['LexicalBase']),
+                          lambda r: r.data.shape[0])
+        measure(results, 'CompactMorphoBR.read',
+                lambda: CompactMorphoBR.read(paths['MorphoBR']),
+                lambda r: r.entry_keys.shape[0])
+        morphobr = measure(results, 'MorphoBR.read',
+                           lambda: MorphoBR.read(paths['MorphoBR']),
+                           lambda r: len(r.entries))
+        measure(results, 'LIWC.read',
+                lambda: LIWC.read(paths['LIWC']),
+                lambda r: len(r.words))
+        store = measure(results, 'ResourceStore.build',
+                        lambda: ResourceStore.build(
+                            Path(tmpdir) / 'store.sqlite', agglutlex,
+                            FrequencyLexicon.parse(
+                                paths['FrequencyLexicon']),
+                            lexbase, morphobr),
+                        lambda r: agglutlex.data.shape[0])
+        store_generator = AntonymRiddleGenerator(
+            agglutlex, StoreFrequencyLexicon(store), StoreLexicalBase(store),
+            StoreMorphoBR(store))
+        measure(results, 'get_allowed_candidates (store)',
+                store_generator.get_allowed_candidates,
+                lambda r: r.shape[0])
+
+    generator = AntonymRiddleGenerator(agglutlex, freqlex, lexbase, morphobr)
+    df = measure(results, 'get_candidates',
+                 generator.get_candidates,
+                 lambda r: r.shape[0])
+    rows = df.shape[0]
+    df = measure(results, 'filter_candidates_by_rules',
+                 lambda: generator.filter_candidates_by_rules(df),
+                 lambda r: rows)
+    rows = df.shape[0]
+    measure(results, 'compute_candidate_scores',
+            lambda: generator.compute_candidate_scores(df),
+            lambda r: rows)
+    measure(results, 'get_allowed_candidates',
+            generator.get_allowed_candidates,
+            lambda r: r.shape[0])
+    return results
+
+
+def run(args) -> None:
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'seed': args.seed,
+              'scales': dict()}
+    for n_terms in args.scales:
+        print(f'Benchmarking {n_terms} terms', file=sys.stderr)
+        # A new process per scale, so that peak RSS is not carried over
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=get_context('spawn')) as executor:
+            results = executor.submit(benchmark_scale, n_terms,
+                                      args.seed).result()
+        report['scales'][str(n_terms)] = results
+        for name, metrics in results.items():
+            print(f'{n_terms:>10} {name:<30} {metrics["wall_s"]:>9.3f}s '
+                  f'{metrics["peak_memory_mb"]:>9.1f}MB {metrics["rows"]:>10}',
+                  file=sys.stderr)
+    with args.output.open('w', encoding='utf-8') as file_:
+        json.dump(report, file_, indent=4)
+
+
+def compare(args) -> None:
+    '''
+    Flags the stages whose wall time or peak traced memory grew by more than
+    the threshold ratio from the baseline. Exits with status 1 if any did.
+    '''
+    with args.baseline.open(encoding='utf-8') as file_:
+        baseline = json.load(file_)
+    with args.current.open(encoding='utf-8') as file_:
+        current = json.load(file_)
+
+    regressions = 0
+    for scale, stages in current['scales'].items():
+        for name, metrics in stages.items():
+            base = baseline['scales'].get(scale, dict()).get(name)
+            if base is None:
+                continue
+            flags = list()
+            wall_ratio = metrics['wall_s'] / max(base['wall_s'], 1e-9)
+            if wall_ratio > 1 + args.threshold and \
+                    metrics['wall_s'] - base['wall_s'] > args.min_seconds:
+                flags.append('time')
+            # Baselines saved before stages traced their own peak memory
+            # only have the process peak RSS, which is not compared
+            memory_ratio = float('nan')
+            if 'peak_memory_mb' in base:
+                memory_ratio = metrics['peak_memory_mb'] / \
+                    max(base['peak_memory_mb'], 1e-9)
+                if memory_ratio > 1 + args.threshold and \
+                        metrics['peak_memory_mb'] - base['peak_memory_mb'] > \
+                        args.min_memory_mb:
+                    flags.append('memory')
+            regressions += bool(flags)
+            print(f'{scale:>10} {name:<30} time x{wall_ratio:<6.2f} '
+                  f'memory x{memory_ratio:<6.2f} '
+                  f'{"REGRESSION (" + ", ".join(flags) + ")" if flags else ""}')
+    if regressions:
+        print(f'{regressions} regressions found')
+        sys.exit(1)
+
+
+def main(argv=None) -> None:
+    parser = ArgumentParser('SECO benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--scales',
+                            help='Numbers of agglutinated terms to benchmark',
+                            type=int, nargs='+', default=[1000, 10000, 100000])
+    run_parser.add_argument('--seed',
+                            help='Seed of the synthetic resources',
+                            type=int, default=0)
+    run_parser.add_argument('--output', '-o',
+                            help='JSON file to save the results',
+                            type=Path, default=Path('benchmark.json'))
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare',
+                                         help='Compare results to a baseline')
+    compare_parser.add_argument('baseline', type=Path,
+                                help='Baseline JSON results')
+    compare_parser.add_argument('current', type=Path,
+                                help='Current JSON results')
+    compare_parser.add_argument('--threshold',
+                                help='Ratio of growth flagged as regression',
+                                type=float, default=0.2)
+    compare_parser.add_argument('--min_seconds',
+                                help='Ignore time growths shorter than this',
+                                type=float, default=0.05)
+    compare_parser.add_argument('--min_memory_mb',
+                                help='Ignore memory growths smaller than this',
+                                type=float, default=1.0)
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+'''
+Synthetic SECO resources, written in the same file formats as the real
+ones, to benchmark the readers and the riddle generator without them.
+'''
+import random
+from pathlib import Path
+
+consonants = 'bcdfglmnprstv'
+vowels = 'aeiou'
+relations = {'A': 'ANTONIMO_ADJ_DE',
+             'ADV': 'ANTONIMO_ADV_DE',
+             'N': 'ANTONIMO_N_DE',
+             'V': 'ANTONIMO_V_DE'}
+other_relations = ['SINONIMO_N_DE', 'SINONIMO_ADJ_DE', 'HIPERONIMO_DE',
+                   'PARTE_DE', 'CAUSADOR_DE']
+folders = {'A': 'adjectives',
+           'ADV': 'adverbs',
+           'N': 'nouns',
+           'V': 'verbs'}
+liwc_tags = ['funct', 'pronoun', 'posemo', 'negemo', 'social', 'cogmech',
+             'percept', 'bio', 'relativ', 'time']
+
+
+def make_stem(rng, syllables):
+    return ''.join(rng.choice(consonants) + rng.choice(vowels)
+                   for _ in range(syllables))
+
+
+def make_lemma(rng, pos):
+    stem = make_stem(rng, rng.randint(1, 3))
+    if pos == 'V':
+        return stem + rng.choice(['ar', 'er', 'ir'])
+    elif pos == 'A':
+        return stem + rng.choice(['o', 'ivo', 'oso'])
+    elif pos == 'ADV':
+        return stem + 'mente'
+    return stem + rng.choice(['a', 'o', 'e', 'or'])
+
+
+def inflect(lemma, pos):
+    '''
+    (word, features) pairs of a lemma, in MorphoBR notation.
+    '''
+    if pos == 'N':
+        return [(lemma, 'N+M+SG'), (lemma + 's', 'N+M+PL')]
+    elif pos == 'A':
+        stem = lemma[:-1]
+        return [(lemma, 'A+M+SG'), (lemma + 's', 'A+M+PL'),
+                (stem + 'a', 'A+F+SG'), (stem + 'as', 'A+F+PL')]
+    elif pos == 'ADV':
+        return [(lemma, 'ADV')]
+    stem = lemma[:-2]
+    return [(lemma, 'V+INF'), (stem + 'o', 'V+PRS+1+SG'),
+            (stem + lemma[-2], 'V+PRS+3+SG'),
+            (stem + lemma[-2] + 'mos', 'V+PRS+1+PL')]
+
+
+def write_resources(dirpath: Path, n_terms: int, seed: int = 0) -> dict:
+    '''
+    Writes a synthetic version of every SECO resource with about `n_terms`
+    agglutinated terms to `dirpath`.
+
+    Return:
+        dict - Path of each resource, by reader name
+    '''
+    rng = random.Random(seed)
+    dirpath.mkdir(parents=True, exist_ok=True)
+
+    # Lexicon with about two lemmas per term
+    lemmas = dict()
+    while len(lemmas) < max(40, 2 * n_terms):
+        pos = rng.choice(['A', 'A', 'ADV', 'N', 'N', 'N', 'V', 'V'])
+        lemmas.setdefault(make_lemma(rng, pos), pos)
+    by_pos = {pos: [l for l in lemmas if lemmas[l] == pos] for pos in folders}
+
+    # MorphoBR: one file per folder and initial letter
+    morphobr = dirpath / 'MorphoBR'
+    forms = dict()
+    for pos, folder in folders.items():
+        files = dict()
+        for lemma in by_pos[pos]:
+            forms[lemma] = inflect(lemma, pos)
+            files.setdefault(lemma[0], []).extend(
+                f'{word}\t{lemma}+{feats}\n' for word, feats in forms[lemma])
+        (morphobr / folder).mkdir(parents=True, exist_ok=True)
+        for letter, lines in files.items():
+            filepath = morphobr / folder / f'{folder}-{letter}.dict'
+            with filepath.open('w', encoding='utf-8') as file_:
+                file_.writelines(lines)
+
+    # Onto.PT triples: antonyms pair up half of the lemmas of each POS
+    triples = dirpath / 'triples.txt'
+    antonymous = list()
+    with triples.open('w', encoding='utf-8') as file_:
+        for pos, pos_lemmas in by_pos.items():
+            pos_lemmas = pos_lemmas[:]
+            rng.shuffle(pos_lemmas)
+            for lemma1, lemma2 in zip(pos_lemmas[0:len(pos_lemmas) // 2:2],
+                                      pos_lemmas[1:len(pos_lemmas) // 2:2]):
+                antonymous.extend([lemma1, lemma2])
+                file_.write(f'{lemma1} {relations[pos]} {lemma2}\t'
+                            f'{rng.randint(1, 10)}\n')
+                if rng.random() < 0.3:
+                    file_.write(f'{lemma2} {relations[pos]} {lemma1}\t'
+                                f'{rng.randint(1, 10)}\n')
+        all_lemmas = list(lemmas)
+        for _ in range(3 * len(all_lemmas)):
+            file_.write(f'{rng.choice(all_lemmas)} '
+                        f'{rng.choice(other_relations)} '
+                        f'{rng.choice(all_lemmas)}\t{rng.randint(1, 10)}\n')
+
+    # Agglutination lexicon, mostly of parts whose lemmas have antonyms
+    agglutlex = dirpath / 'aglut_lexico.txt'
+    terms = list()
+    with agglutlex.open('w', encoding='utf-8') as file_:
+        file_.write('#Termo\tP1\tP2\tLema1\tLema2\n')
+        for _ in range(n_terms):
+            parts = list()
+            for _ in range(2):
+                pool = antonymous if rng.random() < 0.8 else all_lemmas
+                lemma = rng.choice(pool)
+                word, _ = rng.choice(forms[lemma])
+                parts.append((word, lemma))
+            (p1, lemma1), (p2, lemma2) = parts
+            terms.append(p1 + p2)
+            file_.write(f'{p1 + p2}\t{p1}\t{p2}\t{lemma1}\t{lemma2}\n')
+
+    # CETEMPublico-like frequencies for most words and terms
+    frequencies = dirpath / 'formas.txt'
+    words = {w for lemma_forms in forms.values() for w, _ in lemma_forms}
+    with frequencies.open('w', encoding='utf-8') as file_:
+        for word in sorted(words.union(terms)):
+            if rng.random() < 0.8:
+                file_.write(f'{int(rng.paretovariate(1.2))}\t{word}\n')
+
+    # LIWC dictionary, with some prefix (*) entries
+    liwc = dirpath / 'liwc.dic'
+    with liwc.open('w', encoding='utf-8') as file_:
+        file_.write('%\n')
+        for id_, tag in enumerate(liwc_tags, start=1):
+            file_.write(f'{id_}\t{tag}\n')
+        file_.write('%\n')
+        for word in sorted(words):
+            if rng.random() < 0.3:
+                entry = word[:3] + '*' if rng.random() < 0.2 else word
+                ids = rng.sample(range(1, len(liwc_tags) + 1),
+                                 rng.randint(1, 3))
+                file_.write('\t'.join([entry] + [str(i) for i in ids]) + '\n')
+
+    return {'AgglutLex': agglutlex,
+            'FrequencyLexicon': frequencies,
+            'LexicalBase': triples,
+            'MorphoBR': morphobr,
+            'LIWC': liwc}
@@ -1,56 +1,84 @@
-import logging
 from argparse import ArgumentParser
 from pathlib import Path
 
-from seco.methods.antonym_riddle import AntonymRiddleGenerator
-from seco.readers.read_agglutlex import AgglutLex
-from seco.readers.read_frequencies import FrequencyLexicon
-from seco.readers.read_kb_triples import LexicalBase
-from seco.readers.read_morphobr import MorphoBR
+from seco import profiling
+from seco.cli import (add_profile_arguments, add_resource_arguments,
+                      check_resource_arguments, configure_logger,
+                      load_generator, resource_sources)
+from seco.methods.incremental import generate_incremental
+from seco.methods.rules import default_rules
+from seco.writers import compressions, formats, open_writer
 
 if __name__ == '__main__':
     parser = ArgumentParser('Antonym riddle generator')
-    parser.add_argument('--agglutination_lexicon',
-                        '-a', help='Agglutination Lexicon file',
-                        type=Path, required=True)
-    parser.add_argument('--frequency_lexicon',
-                        '-f', help='Frequency Lexicon file',
-                        type=Path, required=True)
-    parser.add_argument('--lexical_base',
-                        '-l', help='Lexical Base triples file',
-                        type=Path, required=True)
-    parser.add_argument('--morphological_base',
-                        '-m', help='MorphoBR directory path',
-                        type=Path, required=True)
-    parser.add_argument('--verbose', '-v',
-                        action='count',
-                        help='Verbose level',
-                        default=0, required=False)
+    add_resource_arguments(parser)
+    add_profile_arguments(parser)
+    parser.add_argument('--output',
+                        '-o', help='Output file',
+                        type=Path, default=Path('results.json'), required=False)
+    parser.add_argument('--format',
+                        help='Output format (inferred from the output file by default)',
+                        choices=formats, default=None, required=False)
+    parser.add_argument('--compression',
+                        help='Output compression (inferred from the output file by default)',
+                        choices=compressions, default=None, required=False)
+    parser.add_argument('--chunk_size',
+                        help='Generate and write riddles for this many agglutinations '
+                        'at a time (output is then sorted by score within each chunk only)',
+                        type=int, default=None, required=False)
+    parser.add_argument('--select',
+                        help='Output only k riddles, the best ones (top) or '
+                        'drawn weighted by exp(Score) (sample)',
+                        choices=['top', 'sample'], default=None, required=False)
+    parser.add_argument('-k',
+                        help='Number of riddles to select',
+                        type=int, default=1, required=False)
+    parser.add_argument('--seed',
+                        help='Random seed for sampled riddles',
+                        type=int, default=None, required=False)
+    parser.add_argument('--workers',
+                        help='Processes generating the riddles in parallel shards',
+                        type=int, default=1, required=False)
+    parser.add_argument('--incremental',
+                        help='State file of the previous run: only the riddles of changed '
+                        'agglutinations and antonyms are generated again',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--change_log',
+                        help='File to write the riddles added and removed since the '
+                        'previous incremental run',
+                        type=Path, default=None, required=False)
     args = parser.parse_args()
+    check_resource_arguments(parser, args)
+    if args.select is not None and args.chunk_size is not None:
+        parser.error('--select cannot be combined with --chunk_size')
+    if args.workers > 1 and (args.select is not None or args.chunk_size is not None):
+        parser.error('--workers cannot be combined with --select or --chunk_size')
+    if args.incremental is not None and (args.select is not None or
+                                         args.chunk_size is not None or args.workers > 1):
+        parser.error('--incremental cannot be combined with --select, --chunk_size or --workers')
+    if args.change_log is not None and args.incremental is None:
+        parser.error('--change_log requires --incremental')
 
-    # Configure logger
-    logger = logging.getLogger('riddles')
-    ch = logging.StreamHandler()
-    if args.verbose == 1:
-        logger.setLevel(logging.INFO)
-        ch.setLevel(logging.INFO)
-    elif args.verbose >= 1:
-        logger.setLevel(logging.DEBUG)
-        ch.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
-
-    agglutlex = AgglutLex.read(args.agglutination_lexicon)
-    freqlex = FrequencyLexicon.read(args.frequency_lexicon)
-    lexbase = LexicalBase.read(args.lexical_base)
-    morphobr = MorphoBR.read(args.morphological_base)
-
-    generator = AntonymRiddleGenerator(agglutlex, freqlex, lexbase, morphobr)
-    riddles = generator.generate()
-    with Path('results.json').open('w', encoding='utf-8') as file_:
-        riddles.to_json(file_,
-                        orient='records',
-                        indent=4,
-                        force_ascii=False)
+    configure_logger(args.verbose)
+    if args.profile is not None:
+        profiling.enable(args.cprofile_stage)
+    generator = load_generator(args)
+    with open_writer(args.output, args.format, args.compression) as writer:
+        if args.select is not None:
+            writer.write(generator.select(args.k, args.select, args.seed))
+        elif args.incremental is not None:
+            sources = dict(resource_sources(args),
+                           rules=args.rules or default_rules)
+            riddles, changes = generate_incremental(generator, args.incremental, sources)
+            writer.write(riddles)
+            if args.change_log is not None:
+                with open_writer(args.change_log) as change_writer:
+                    change_writer.write(changes)
+        elif args.chunk_size is None:
+            writer.write(generator.generate(args.workers))
+        else:
+            for riddles in generator.generate_stream(args.chunk_size):
+                writer.write(riddles)
+    if args.profile is not None:
+        profiling.disable().save(args.profile, args.profile_format)
     # print(f'Qual o contrário de {term["#Termo"]}? {antonym1} {antonym2}.')
@@ -0,0 +1,263 @@
+import logging
+import signal
+import socketserver
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+from seco.methods.antonym_riddle import AntonymRiddleGenerator
+from seco.readers.read_agglutlex import AgglutLex
+from seco.readers.read_frequencies import FrequencyLexicon
+from seco.readers.read_kb_triples import LexicalBase, antonymy_relations
+from seco.readers.read_morphobr import CompactMorphoBR, MorphoBR
+from seco.readers.snapshot import read_cached
+from seco.readers.store import (ResourceStore, StoreFrequencyLexicon,
+                                StoreLexicalBase, StoreMorphoBR)
+
+logger = logging.getLogger('riddles')
+# Arguments with the resource files, replaced by a resource store
+resource_arguments = ['agglutination_lexicon', 'frequency_lexicon',
+                      'lexical_base', 'morphological_base']
+
+
+def add_source_arguments(parser: ArgumentParser) -> None:
+    '''
+    Adds the arguments to locate and parse the SECO resource files.
+    '''
+    parser.add_argument('--agglutination_lexicon',
+                        '-a', help='Agglutination Lexicon file',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--frequency_lexicon',
+                        '-f', help='Frequency Lexicon file',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--lexical_base',
+                        '-l', help='Lexical Base triples file',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--morphological_base',
+                        '-m', help='MorphoBR directory path',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--cache_dir',
+                        '-c', help='Directory to keep parsed resources snapshots',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--load_workers',
+                        help='Number of processes used to load MorphoBR '
+                        'and syllabify the Agglutination Lexicon',
+                        type=int, default=1, required=False)
+    parser.add_argument('--prune',
+                        help='Load only the Lexical Base relations and MorphoBR '
+                        'entries reachable from the Agglutination Lexicon',
+                        action='store_true', required=False)
+    parser.add_argument('--verbose', '-v',
+                        action='count',
+                        help='Verbose level',
+                        default=0, required=False)
+
+
+def add_resource_arguments(parser: ArgumentParser) -> None:
+    '''
+    Adds the arguments to locate and load the SECO resources, either from
+    their files or from a resource store.
+    '''
+    add_source_arguments(parser)
+    parser.add_argument('--compact_morphology',
+                        help='Keep MorphoBR in compact integer arrays',
+                        action='store_true', required=False)
+    parser.add_argument('--store',
+                        '-s', help='Resource store built by `seco build-store`, '
+                        'used instead of the resource files',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--store_cache_size',
+                        help='Number of lookups of each kind kept in the LRU '
+                        'caches of the resource store',
+                        type=int, default=2 ** 16, required=False)
+    parser.add_argument('--rules',
+                        help='TSV file with the P1 and P2 parts of speech '
+                        'allowed in riddles',
+                        type=Path, default=None, required=False)
+
+
+def check_resource_arguments(parser: ArgumentParser, args) -> None:
+    '''
+    Checks that either every resource file or a resource store was given.
+    '''
+    if getattr(args, 'store', None) is not None:
+        if args.prune or args.compact_morphology:
+            parser.error('--prune and --compact_morphology cannot be combined '
+                         'with --store')
+        return
+    missing = [f'--{name}' for name in resource_arguments
+               if getattr(args, name) is None]
+    if missing:
+        parser.error(f'the following arguments are required: '
+                     f'{", ".join(missing)}')
+
+
+def resource_sources(args) -> dict:
+    '''
+    Path of each resource given in `args`, by reader name.
+    '''
+    if args.store is not None:
+        return {'ResourceStore': args.store}
+    return {'AgglutLex': args.agglutination_lexicon,
+            'FrequencyLexicon': args.frequency_lexicon,
+            'LexicalBase': args.lexical_base,
+            'MorphoBR': args.morphological_base}
+
+
+def add_profile_arguments(parser: ArgumentParser) -> None:
+    '''
+    Adds the arguments to profile the pipeline stages.
+    '''
+    parser.add_argument('--profile',
+                        help='File to save the time, memory and row counts '
+                        'of each stage',
+                        type=Path, default=None, required=False)
+    parser.add_argument('--profile_format',
+                        help='Format of the profile: a JSON list of stages or '
+                        'a Chrome trace',
+                        choices=['json', 'chrome'], default='json',
+                        required=False)
+    parser.add_argument('--cprofile_stage',
+                        help='Stage to run under cProfile (e.g. '
+                        'get_factorized_candidates), saving its statistics '
+                        'next to the profile',
+                        default=None, required=False)
+
+
+def configure_logger(verbose: int) -> None:
+    ch = logging.StreamHandler()
+    if verbose == 1:
+        logger.setLevel(logging.INFO)
+        ch.setLevel(logging.INFO)
+    elif verbose >= 1:
+        logger.setLevel(logging.DEBUG)
+        ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+def load_resources(args, morph_reader=MorphoBR) -> tuple:
+    '''
+    Reads the resource files given in `args`, with MorphoBR read by
+    `morph_reader`.
+
+    Return:
+        (AgglutLex, FrequencyLexicon, LexicalBase, MorphoBR) - Resources
+    '''
+    syllable_cache = None if args.cache_dir is None \
+        else args.cache_dir / 'syllables.pkl'
+    agglutlex = read_cached(AgglutLex, args.agglutination_lexicon,
+                            args.cache_dir, workers=args.load_workers,
+                            syllable_cache=syllable_cache)
+    freqlex = read_cached(FrequencyLexicon, args.frequency_lexicon,
+                          args.cache_dir)
+    lexbase_options, morph_options = dict(), dict()
+    if args.prune:
+        # Riddles only use the parts and lemmas of agglutinations in syllable,
+        # and the antonyms of those lemmas
+        words, lemmas = agglutlex.vocabulary()
+        lexbase_options['words'] = lemmas
+        lexbase_options['relations'] = antonymy_relations
+    lexbase = read_cached(LexicalBase, args.lexical_base,
+                          args.cache_dir, **lexbase_options)
+    if args.prune:
+        morph_options['words'] = words
+        morph_options['lemmas'] = frozenset(lexbase.antonymy_edges['Antonym'])
+    morphobr = read_cached(morph_reader, args.morphological_base,
+                           args.cache_dir, workers=args.load_workers,
+                           **morph_options)
+    return agglutlex, freqlex, lexbase, morphobr
+
+
+def load_generator(args) -> AntonymRiddleGenerator:
+    '''
+    Loads the resources given in `args` into a riddle generator. With a
+    resource store, only the Agglutination Lexicon is loaded into memory,
+    and the other resources are looked up in the store.
+    '''
+    if args.store is not None:
+        store = ResourceStore(args.store, cache_size=args.store_cache_size)
+        resources = (store.agglutlex(), StoreFrequencyLexicon(store),
+                     StoreLexicalBase(store), StoreMorphoBR(store))
+    else:
+        morph_reader = CompactMorphoBR if args.compact_morphology \
+            else MorphoBR
+        resources = load_resources(args, morph_reader)
+    return AntonymRiddleGenerator(*resources, rules=args.rules)
+
+
+def build_store(args) -> None:
+    agglutlex, _, lexbase, morphobr = load_resources(args)
+    # The Frequency Lexicon keeps only hashes, so the words are parsed again
+    frequencies = FrequencyLexicon.parse(args.frequency_lexicon)
+    ResourceStore.build(args.output, agglutlex, frequencies, lexbase,
+                        morphobr)
+
+
+def serve(args) -> None:
+    from seco.server import RiddleService, make_server
+
+    generator = load_generator(args)
+    service = RiddleService(generator, cache_size=args.cache_size)
+    server = make_server(service, host=args.host, port=args.port,
+                         socket_path=args.socket, workers=args.workers)
+    logger.info(f'Serving riddles on {server.address}')
+    # Stop cleanly (closing the socket) when terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None) -> None:
+    parser = ArgumentParser('seco')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve',
+                                       help='Serve riddles over HTTP with '
+                                       'the resources loaded once')
+    add_resource_arguments(serve_parser)
+    serve_parser.add_argument('--host',
+                              help='Address to listen on',
+                              default='127.0.0.1', required=False)
+    serve_parser.add_argument('--port',
+                              help='TCP port to listen on',
+                              type=int, default=8000, required=False)
+    serve_parser.add_argument('--socket',
+                              help='Unix socket to listen on, instead of TCP',
+                              type=Path, default=None, required=False)
+    serve_parser.add_argument('--workers',
+                              help='Number of threads answering requests',
+                              type=int, default=4, required=False)
+    serve_parser.add_argument('--cache_size',
+                              help='Number of answers kept in the LRU cache',
+                              type=int, default=1024, required=False)
+    serve_parser.set_defaults(func=serve)
+
+    store_parser = commands.add_parser('build-store',
+                                       help='Build a resource store, to '
+                                       'generate riddles without loading the '
+                                       'resources into memory')
+    add_source_arguments(store_parser)
+    store_parser.add_argument('--output',
+                              '-o', help='Resource store file',
+                              type=Path, default=Path('seco.sqlite'),
+                              required=False)
+    store_parser.set_defaults(func=build_store)
+
+    args = parser.parse_args(argv)
+    check_resource_arguments(parser, args)
+    if getattr(args, 'socket', None) is not None and \
+            not hasattr(socketserver, 'UnixStreamServer'):
+        parser.error('--socket needs Unix sockets, which are not available '
+                     'on this platform')
+    configure_logger(args.verbose)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
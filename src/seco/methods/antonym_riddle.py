@@ -1,149 +1,369 @@
 import logging
-import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
 
+import numpy as np
 import pandas as pd
-from numpy import exp, log
+from numpy import log
+
+from seco.profiling import profiled, stage
+
+from .candidates import Candidates
+from .rules import load_rules
+from .selection import RiddlePool
 
 logger = logging.getLogger('riddles')
+# Generator shared with forked shard workers
+_worker_generator = None
+
+
+def isin(values, collection):
+    '''
+    `values.isin(collection)` for a set or index `collection`. When there are
+    fewer values than items in the collection, each value is looked up instead,
+    so that small inputs do not pay for hashing the whole collection.
+    Collections kept in a resource store are looked up in batches.
+    '''
+    if hasattr(collection, 'contains_many'):
+        return pd.Series(collection.contains_many(values),
+                         index=values.index, dtype=bool)
+    if len(values) < len(collection):
+        return pd.Series([v in collection for v in values],
+                         index=values.index, dtype=bool)
+    return values.isin(collection)
 
 
 class AntonymRiddleGenerator(object):
-    def __init__(self, agglutlex, freqlex, lexbase, morphbase):
+    def __init__(self, agglutlex, freqlex, lexbase, morphbase, rules=None):
         self.agglutlex = agglutlex
         self.freqlex = freqlex
         self.lexbase = lexbase
         self.morphbase = morphbase
+        self.allowed_pos = load_rules(rules)
+        self.pool = None
+        self.totals = None
+
+    @profiled('get_candidates')
+    def get_candidates(self, data=None):
+        '''
+        Builds the riddle candidates for the agglutinations in `data`, a slice
+        of the agglutination lexicon (the whole lexicon by default), with one
+        row per candidate.
+        '''
+        candidates = self.get_factorized_candidates(data)
+        self.resolve_lexical_forms(candidates)
+        return candidates.expand()
+
+    @profiled('get_factorized_candidates')
+    def get_factorized_candidates(self, data=None):
+        '''
+        Builds the riddle candidates for the agglutinations in `data` (the
+        whole lexicon by default), in factorized form (see `Candidates`).
+        '''
+        if data is None:
+            data = self.agglutlex.data
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        with stage('syllable filter', rows_in=data.shape[0]) as record:
+            logger.info('Retrieving words with agglutination in syllable')
+            agglut_in_syllable = data['Agglutination in syllable']
+            df = data.loc[agglut_in_syllable, :]
+            logger.info(f'{df.shape[0]} retrieved')
+            record['rows_out'] = df.shape[0]
+
+        with stage('antonymy filter', rows_in=df.shape[0]) as record:
+            logger.info('Removing items whose parts do not have antonyms')
+            words_with_antonymy = self.lexbase.words_with_antonymy()
+            p1_has_antonym = isin(df['Lema1'], words_with_antonymy)
+            p2_has_antonym = isin(df['Lema2'], words_with_antonymy)
+            df = df.loc[p1_has_antonym & p2_has_antonym, :]
+            logger.info(f'{df.shape[0]} items left')
+            record['rows_out'] = df.shape[0]
+
+        with stage('vocabulary filter', rows_in=df.shape[0]) as record:
+            logger.info('Keeping only nouns, adjectives, adverbs and verbs')
+            words_to_remove = df.loc[~isin(df['P1'], self.morphbase.vocab) |
+                                     ~isin(df['P2'], self.morphbase.vocab), :]
+            if debug:
+                logger.debug(f'Removed the following words\n{words_to_remove}')
+            df.drop(index=words_to_remove.index, inplace=True)
+            record['rows_out'] = df.shape[0]
+
+        with stage('antonyms', rows_in=df.shape[0]):
+            logger.info('Retrieving antonyms')
+            antonyms = {'P1': self.lexbase.antonyms_of_many(df['Lema1']),
+                        'P2': self.lexbase.antonyms_of_many(df['Lema2'])}
+            if debug:
+                logger.debug(f'P1 Antonyms\n{antonyms["P1"]}')
+                logger.debug(f'P2 Antonyms\n{antonyms["P2"]}')
+
+        with stage('morphology', rows_in=df.shape[0]) as record:
+            logger.info('Performing morphological analysis')
+            features = {'P1': self.morphbase.get_feats(df['P1'], df['Lema1']),
+                        'P2': self.morphbase.get_feats(df['P2'], df['Lema2'])}
+            if debug:
+                logger.debug(f'P1 Morphological Features\n{features["P1"]}')
+                logger.debug(f'P2 Morphological Features\n{features["P2"]}')
+            candidates = Candidates(df, antonyms, features)
+            record['rows_out'] = len(candidates)
+        return candidates
+
+    def resolve_lexical_forms(self, candidates):
+        '''
+        Resolves the lexical forms of the antonyms of factorized
+        `candidates`, for the feature pairs they have left.
+        '''
+        with stage('lexical forms', rows_in=len(candidates)) as record:
+            logger.info('Retrieving antonyms lexical forms')
+            record['keys'] = candidates.resolve_lexical_forms(self.morphbase)
+            logger.info(f'{record["keys"]} lexical forms resolved for '
+                        f'{len(candidates)} candidates')
+
+    def get_allowed_candidates(self, data=None):
+        '''
+        Builds the candidates for the agglutinations in `data` (the whole
+        lexicon by default) allowed by the rules matrix. Rules are applied to
+        the factorized candidates, which are only then expanded to rows.
+        '''
+        return self.expand_allowed(self.get_factorized_candidates(data))
 
-    def get_candidates(self):
-        logger.info('Retrieving words with agglutination in syllable')
-        agglut_in_syllable = self.agglutlex.data['Agglutination in syllable']
-        df = self.agglutlex.data.loc[agglut_in_syllable, :]
-        logger.info(f'{df.shape[0]} retrieved')
-
-        logger.info('Removing items whose parts do not have antonyms')
-        words_with_antonymy = self.lexbase.words_with_antonymy()
-        p1_has_antonym = df['Lema1'].isin(words_with_antonymy)
-        p2_has_antonym = df['Lema2'].isin(words_with_antonymy)
-        df = df.loc[p1_has_antonym & p2_has_antonym, :]
-        logger.info(f'{df.shape[0]} items left')
-
-        logger.info('Keeping only nouns, adjectives, adverbs and verbs')
-        words_to_remove = df.loc[~df['P1'].isin(self.morphbase.vocab) |
-                                 ~df['P2'].isin(self.morphbase.vocab), :]
-        logger.debug(f'Removed the following words\n{words_to_remove}')
-        df.drop(index=words_to_remove.index, inplace=True)
-
-        logger.info('Retrieving antonyms')
-        p1_antonyms = df['Lema1'].apply(self.lexbase.antonyms_of)
-        p2_antonyms = df['Lema2'].apply(self.lexbase.antonyms_of)
-        df['P1 Antonyms'] = p1_antonyms
-        df['P2 Antonyms'] = p2_antonyms
-        logger.debug(f'P1 Antonyms\n{p1_antonyms}')
-        logger.debug(f'P2 Antonyms\n{p2_antonyms}')
-
-        # Unpack lists of antonyms in candidates DataFrame
-        df = df.explode('P1 Antonyms')
-        df = df.explode('P2 Antonyms')
-        df.reset_index(drop=True, inplace=True)
-
-        logger.info('Performing morphological analysis')
-        p1_feats = self.morphbase.get_feats(df['P1'],
-                                            df['Lema1'])
-        p2_feats = self.morphbase.get_feats(df['P2'],
-                                            df['Lema2'])
-        df['P1 Features'] = p1_feats
-        df['P2 Features'] = p2_feats
-        logger.debug(f'P1 Morphological Features\n{p1_feats}')
-        logger.debug(f'P2 Morphological Features\n{p2_feats}')
-
-        # Unpack lists of features in candidates DataFrams
-        df = df.explode('P1 Features')
-        df = df.explode('P2 Features')
-        df.reset_index(drop=True, inplace=True)
-
-        logger.info('Retrieving antonyms lexical forms')
-        p1_ant_lex_form = self.morphbase.get_lexical_forms(df['P1 Antonyms'],
-                                                           df['P1 Features'])
-        p2_ant_lex_form = self.morphbase.get_lexical_forms(df['P2 Antonyms'],
-                                                           df['P2 Features'])
-        df['P1 Antonym Lexical Form'] = p1_ant_lex_form
-        df['P2 Antonym Lexical Form'] = p2_ant_lex_form
-        logger.debug(f'P1 Antonyms Lexical Forms\n{p1_ant_lex_form}')
-        logger.debug(f'P2 Antonyms Lexical Forms\n{p2_ant_lex_form}')
-        logger.debug(f'\n{df}')
+    def expand_allowed(self, candidates):
+        '''
+        Filters factorized `candidates` through the rules matrix, and resolves
+        the lexical forms of those left before expanding them to rows.
+        '''
+        with stage('filter_candidates_by_rules',
+                   rows_in=len(candidates)) as record:
+            logger.info('Filtering candidates through rules')
+            rows = len(candidates)
+            candidates.filter_by_rules(self.allowed_pos,
+                                       self.morphbase.pos_codes)
+            logger.info(f'Removed {rows - len(candidates)} candidates')
+            record['rows_out'] = len(candidates)
+        self.resolve_lexical_forms(candidates)
+        with stage('expand candidates', rows_in=len(candidates)):
+            df = candidates.expand()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'\n{df}')
         return df
 
+    @profiled('filter_candidates_by_rules')
     def filter_candidates_by_rules(self, df):
+        '''
+        Keeps the candidates whose P1 and P2 parts of speech are allowed by
+        the rules matrix.
+        '''
         logger.info('Filtering candidates through rules')
-        adj_re = re.compile(r'^(A)(?:$|\+)')
-        adv_re = re.compile(r'^(ADV)(?:$|\+)')
-        v_re = re.compile(r'^(V)(?:$|\+)')
-        n_re = re.compile(r'^(N)(?:$|\+)')
-
-        p1_adj = df['P1 Features'].str.match(adj_re)
-        p1_adv = df['P1 Features'].str.match(adv_re)
-        p1_v = df['P1 Features'].str.match(v_re)
-        p1_n = df['P1 Features'].str.match(n_re)
-
-        p2_adj = df['P2 Features'].str.match(adj_re)
-        p2_adv = df['P2 Features'].str.match(adv_re)
-        p2_v = df['P2 Features'].str.match(v_re)
-        p2_n = df['P2 Features'].str.match(n_re)
-
-        # Rules
-        rules = (p1_adj & p2_adj) | \
-            (p1_adj & p2_adv) | \
-            (p1_adj & p2_n) | \
-            (p1_adv & p2_adj) | \
-            (p1_adv & p2_v) | \
-            (p1_v & p2_adv) | \
-            (p1_v & p2_n) | \
-            (p1_n & p2_adj) | \
-            (p1_n & p2_v)
-        logger.info(f'Removed {df.loc[~rules, :].shape[0]} candidates')
+        p1_pos = self.morphbase.pos_codes(df['P1 Features'])
+        p2_pos = self.morphbase.pos_codes(df['P2 Features'])
+        rules = self.allowed_pos[p1_pos, p2_pos]
+        logger.info(f'Removed {(~rules).sum()} candidates')
         return df.loc[rules, :]
 
-    def compute_candidate_scores(self, df):
+    def get_candidate_frequencies(self, df):
+        '''
+        Smoothed corpus frequencies of the term, P1 and P2 of each candidate.
+        Candidates of a term share these words, so each distinct word is
+        looked up once.
+        '''
+        freqs = pd.DataFrame(index=df.index)
+        for column in ['#Termo', 'P1', 'P2']:
+            codes, words = pd.factorize(df[column], use_na_sentinel=False)
+            words = pd.Series(words, dtype=object)
+            freqs[column] = self.freqlex.lookup(words, smoothing=True)[codes]
+        return freqs
+
+    def get_candidates_parallel(self, workers, shards_per_worker=4):
+        '''
+        Builds and filters the candidates of the whole agglutination lexicon,
+        and looks up their frequencies, in `workers` forked processes. The
+        lexicon is split in contiguous shards that never split a term, and
+        workers read the resources of this generator through copy-on-write
+        memory, so only shard bounds and results are pickled. Shards are
+        merged in order, with the same index as `get_candidates`.
+
+        Return:
+            (pandas.DataFrame, pandas.DataFrame) - Candidates and frequencies
+        '''
+        global _worker_generator
+        data = self.agglutlex.data
+        bounds = shard_bounds(data['#Termo'], workers * shards_per_worker)
+        logger.info(f'Generating candidates in {len(bounds)} shards '
+                    f'with {workers} workers')
+        _worker_generator = self
+        try:
+            with stage('sharded candidates', rows_in=data.shape[0]) as record, \
+                    ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=get_context('fork')) \
+                    as executor:
+                shards = list(executor.map(_generate_shard, bounds))
+                record['rows_out'] = sum(df.shape[0] for _, df, _ in shards)
+        finally:
+            _worker_generator = None
+
+        # Shift shard indexes as if candidates were built all at once
+        frames, freqs, offset = list(), list(), 0
+        for rows, df, shard_freqs in shards:
+            df.index = df.index + offset
+            shard_freqs.index = shard_freqs.index + offset
+            offset += rows
+            if df.shape[0] > 0:
+                frames.append(df)
+                freqs.append(shard_freqs)
+        if not frames:
+            return shards[0][1], shards[0][2]
+        return pd.concat(frames), pd.concat(freqs)
+
+    @profiled('compute_candidate_scores')
+    def compute_candidate_scores(self, df, totals=None, sort=True,
+                                 freqs=None):
+        '''
+        Scores candidates by the sum of the log probabilities of their term,
+        P1 and P2. Probabilities are normalised by `totals`, the frequency
+        sums over all candidates, which default to the sums over `df`.
+        Candidates are sorted by score unless `sort` is false. Frequencies
+        already looked up can be given in `freqs`.
+        '''
+        if freqs is None:
+            freqs = self.get_candidate_frequencies(df)
+        if totals is None:
+            totals = freqs.sum()
+
         logger.info('Calculating log probability for candidate words')
-        termo_freq = self.freqlex.get_frequencies(df['#Termo'], smoothing=True)
-        termo_freq = df['#Termo'].map(termo_freq)
-        termo_prob = termo_freq / termo_freq.sum()
+        termo_prob = freqs['#Termo'] / totals['#Termo']
         df['#Termo Log Probability'] = log(termo_prob)
 
         logger.info('Calculating log probability for P1')
-        p1_freq = self.freqlex.get_frequencies(df['P1'], smoothing=True)
-        p1_freq = df['P1'].map(p1_freq)
-        p1_prob = p1_freq / p1_freq.sum()
+        p1_prob = freqs['P1'] / totals['P1']
         df['P1 Log Probability'] = log(p1_prob)
 
         logger.info('Calculating log probability for P2')
-        p2_freq = self.freqlex.get_frequencies(df['P2'], smoothing=True)
-        p2_freq = df['P2'].map(p2_freq)
-        p2_prob = p2_freq / p2_freq.sum()
+        p2_prob = freqs['P2'] / totals['P2']
         df['P2 Log Probability'] = log(p2_prob)
 
-        logger.info('Calculating and sorting by score')
+        logger.info('Calculating score')
         df['Score'] = df['#Termo Log Probability'] + \
             df['P1 Log Probability'] + \
             df['P2 Log Probability']
-        df.sort_values(by='Score', ascending=False, inplace=True)
-        logger.debug(f'\n{df}')
-        logger.debug(f'\n{df.describe()}')
+        if sort:
+            logger.info('Sorting by score')
+            df.sort_values(by='Score', ascending=False, inplace=True)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'\n{df}')
+            logger.debug(f'\n{df.describe()}')
         return df
 
-    def generate(self):
-        df = self.get_candidates()
-        df = self.filter_candidates_by_rules(df)
+    def generate(self, workers=1):
+        '''
+        Generates all scored candidates. With more than one worker, candidates
+        are built in parallel by `get_candidates_parallel`, and then scored
+        together, with the same result as a serial run.
+        '''
+        if workers > 1 and 'fork' not in get_all_start_methods():
+            logger.warning('Parallel generation needs the fork start method, '
+                           'generating serially')
+            workers = 1
+        if workers > 1:
+            df, freqs = self.get_candidates_parallel(workers)
+            return self.compute_candidate_scores(df, freqs=freqs)
+
+        df = self.get_allowed_candidates()
         df = self.compute_candidate_scores(df)
 
         return df
 
-        # df = self.compute_candidate_scores(df)
-        # logger.info('Retrieving term for riddle')
-        # term = candidates.sample(weights=exp(candidates['Score']),
-        #                          n=1).squeeze()
-        # logger.debug(f'Selected term\n{term}')
+    def get_totals(self, chunk_size=1000):
+        '''
+        Frequency sums of the terms, P1 and P2 over all candidates, used to
+        normalise scores. They are computed `chunk_size` agglutinations at a
+        time on the first call only, and kept for the following ones.
+        '''
+        if self.totals is None:
+            data = self.agglutlex.data
+            logger.info('Computing frequency totals over '
+                        f'{data.shape[0]} agglutinations')
+            totals = None
+            for start in range(0, data.shape[0], chunk_size):
+                df = self.get_allowed_candidates(
+                    data.iloc[start:start + chunk_size])
+                chunk_totals = self.get_candidate_frequencies(df).sum()
+                totals = chunk_totals if totals is None \
+                    else totals + chunk_totals
+            self.totals = totals
+        return self.totals
+
+    def generate_stream(self, chunk_size=1000):
+        '''
+        Generates the same scored candidates as `generate`, building them for
+        `chunk_size` agglutinations at a time and yielding one DataFrame per
+        chunk, each sorted by score. The frequency totals used to normalise
+        the scores come from `get_totals`, so only one chunk of candidates is
+        kept in memory at a time.
+        '''
+        totals = self.get_totals(chunk_size)
+        data = self.agglutlex.data
+        for start in range(0, data.shape[0], chunk_size):
+            df = self.get_allowed_candidates(
+                data.iloc[start:start + chunk_size])
+            if df.shape[0] > 0:
+                yield self.compute_candidate_scores(df, totals)
+
+    def generate_for(self, terms):
+        '''
+        Generates the scored candidates of the agglutinated `terms` only, with
+        the same scores as `generate`. Besides the frequency totals, computed
+        once by `get_totals`, the work only depends on the candidates of
+        `terms`.
+        '''
+        totals = self.get_totals()
+        df = self.get_allowed_candidates(self.agglutlex.filter_words(terms))
+        return self.compute_candidate_scores(df, totals)
+
+    def get_pool(self):
+        '''
+        Pool with all scored candidates, generated and scored on the first
+        call only, and kept for the following ones.
+        '''
+        if self.pool is None:
+            df = self.get_allowed_candidates()
+            df = self.compute_candidate_scores(df, sort=False)
+            self.pool = RiddlePool(df)
+        return self.pool
+
+    def select(self, k=1, mode='top', seed=None):
+        '''
+        Selects `k` riddles from all scored candidates, either the best ones
+        (`mode='top'`) or drawn with probability proportional to `exp(Score)`
+        (`mode='sample'`).
+        '''
+        logger.info(f'Selecting {k} riddles ({mode})')
+        return self.get_pool().select(k, mode, seed)
+
+
+def shard_bounds(terms, n_shards):
+    '''
+    Splits `terms` in up to `n_shards` contiguous (start, stop) ranges of
+    about the same size, moving each boundary forward past repeated terms so
+    that consecutive rows of a term stay in the same shard.
+    '''
+    n_rows = len(terms)
+    stops = np.linspace(0, n_rows, max(n_shards, 1) + 1).astype(int)[1:]
+    terms = terms.to_numpy()
+    bounds, start = list(), 0
+    for stop in stops.tolist():
+        while start < stop < n_rows and terms[stop] == terms[stop - 1]:
+            stop += 1
+        if stop > start:
+            bounds.append((start, stop))
+            start = stop
+    return bounds or [(0, 0)]
 
-        # logger.info('Create combined antonyms using rules')
 
-        # return term, p1_ant_lex_form, p2_ant_lex_form
+def _generate_shard(bounds):
+    start, stop = bounds
+    generator = _worker_generator
+    data = generator.agglutlex.data.iloc[start:stop]
+    candidates = generator.get_factorized_candidates(data)
+    rows = len(candidates)
+    df = generator.expand_allowed(candidates)
+    return rows, df, generator.get_candidate_frequencies(df)
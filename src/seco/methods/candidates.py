@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+
+parts = ['P1', 'P2']
+
+
+class Candidates(object):
+    '''
+    Riddle candidates in factorized form.
+
+    Rather than one row per combination of the antonyms and features of both
+    parts of each agglutination, the antonyms and features of each part are
+    kept as flat lists, with offsets delimiting the lists of each
+    agglutination. The (P1, P2) feature pairs still allowed for each
+    agglutination are kept in a pair index, and lexical forms are resolved
+    once per distinct (antonym, feature) key. Rows are only built by
+    `expand`, in the same order and with the same index as exploding the
+    antonyms and features one after another.
+    '''
+
+    def __init__(self, terms: pd.DataFrame, antonyms: dict,
+                 features: dict) -> None:
+        '''
+        Arguments:
+            terms: pandas.DataFrame - Agglutinations, one per row
+            antonyms: dict - Collection of antonyms of each term, by part
+            features: dict - Collection of features of each term, by part
+        '''
+        self.terms = terms.reset_index(drop=True)
+        self.antonyms = {p: flatten(antonyms[p]) for p in parts}
+        self.features = {p: flatten(features[p]) for p in parts}
+        self.forms = dict()
+
+        counts = [np.diff(self.features[p][1]) for p in parts]
+        pair_rows, positions = repeat_positions(counts[0] * counts[1])
+        self.pair_rows = pair_rows
+        self.pair_features = (positions // counts[1][pair_rows],
+                              positions % counts[1][pair_rows])
+
+    def counts(self, collections: dict) -> list:
+        return [np.diff(collections[p][1]) for p in parts]
+
+    def __len__(self) -> int:
+        '''
+        Number of rows of the expanded candidates.
+        '''
+        n_antonyms = self.counts(self.antonyms)
+        n_pairs = np.bincount(self.pair_rows, minlength=self.terms.shape[0])
+        return int((n_antonyms[0] * n_antonyms[1] * n_pairs).sum())
+
+    def sizes(self) -> np.ndarray:
+        '''
+        Number of candidates of each term, before any pair was filtered.
+        '''
+        n_antonyms = self.counts(self.antonyms)
+        n_features = self.counts(self.features)
+        return n_antonyms[0] * n_antonyms[1] * n_features[0] * n_features[1]
+
+    def resolve_lexical_forms(self, morphbase) -> int:
+        '''
+        Resolves the lexical form of the antonyms of each part for the
+        features left in some feature pair, looking up each distinct
+        (antonym, feature) key once. Filtering the pairs by the rules first
+        leaves fewer keys to look up.
+
+        Return:
+            int - Number of distinct keys looked up
+        '''
+        n_keys = 0
+        for part, positions in zip(parts, self.pair_features):
+            antonyms, antonym_offsets = self.antonyms[part]
+            features, feature_offsets = self.features[part]
+            # Features of each term in some pair, with all its antonyms
+            feature_ids, first = np.unique(
+                feature_offsets[self.pair_rows] + positions, return_index=True)
+            rows = self.pair_rows[first]
+            parents, antonym_positions = repeat_positions(
+                np.diff(antonym_offsets)[rows])
+            antonym_ids = antonym_offsets[rows[parents]] + antonym_positions
+            feature_ids = feature_ids[parents]
+
+            codes = (pd.factorize(antonyms, use_na_sentinel=False)[0],
+                     pd.factorize(features, use_na_sentinel=False)[0])
+            keys, first = np.unique(form_keys(codes, antonym_ids, feature_ids),
+                                    return_index=True)
+            forms = morphbase.get_lexical_forms(
+                pd.Series(antonyms[antonym_ids[first]], dtype=object),
+                pd.Series(features[feature_ids[first]], dtype=object))
+            self.forms[part] = (codes, keys, np.asarray(forms, dtype=object))
+            n_keys += len(keys)
+        return n_keys
+
+    def filter_by_rules(self, allowed_pos: np.ndarray, pos_codes) -> None:
+        '''
+        Keeps the feature pairs whose parts of speech are allowed by the
+        rules matrix `allowed_pos`, with the part of speech codes of the
+        features given by `pos_codes`.
+        '''
+        codes = list()
+        for part, positions in zip(parts, self.pair_features):
+            features, offsets = self.features[part]
+            codes.append(pos_codes(features)[offsets[self.pair_rows] +
+                                             positions])
+        allowed = allowed_pos[codes[0], codes[1]]
+        self.pair_rows = self.pair_rows[allowed]
+        self.pair_features = tuple(p[allowed] for p in self.pair_features)
+
+    def expand(self) -> pd.DataFrame:
+        '''
+        Builds one row per candidate: a term with an antonym and a feature of
+        each part, and the lexical forms of the antonyms. Rows are indexed by
+        their position among all the candidates, as if no pair was filtered.
+        '''
+        n_antonyms = self.counts(self.antonyms)
+        n_features = self.counts(self.features)
+        n_pairs = np.bincount(self.pair_rows, minlength=self.terms.shape[0])
+        pair_offsets = np.zeros(len(n_pairs) + 1, dtype=np.int64)
+        np.cumsum(n_pairs, out=pair_offsets[1:])
+
+        # P1 antonyms, then P2 antonyms, then feature pairs of each term
+        rows, antonyms1 = repeat_positions(n_antonyms[0])
+        parents, antonyms2 = repeat_positions(n_antonyms[1][rows])
+        rows, antonyms1 = rows[parents], antonyms1[parents]
+        parents, pairs = repeat_positions(n_pairs[rows])
+        rows = rows[parents]
+        antonym_positions = (antonyms1[parents], antonyms2[parents])
+        pairs = pair_offsets[rows] + pairs
+        feature_positions = tuple(p[pairs] for p in self.pair_features)
+
+        df = self.terms.iloc[rows].reset_index(drop=True)
+        antonym_ids, feature_ids = dict(), dict()
+        for part, antonym in zip(parts, antonym_positions):
+            antonyms, offsets = self.antonyms[part]
+            antonym_ids[part] = offsets[rows] + antonym
+            df[f'{part} Antonyms'] = antonyms[antonym_ids[part]]
+        for part, feature in zip(parts, feature_positions):
+            features, offsets = self.features[part]
+            feature_ids[part] = offsets[rows] + feature
+            df[f'{part} Features'] = features[feature_ids[part]]
+        for part in parts:
+            if part not in self.forms:
+                continue
+            codes, keys, forms = self.forms[part]
+            form_ids = np.searchsorted(
+                keys, form_keys(codes, antonym_ids[part], feature_ids[part]))
+            df[f'{part} Antonym Lexical Form'] = forms[form_ids]
+
+        # Position among all candidates, before any pair was filtered
+        sizes = self.sizes()
+        starts = np.cumsum(sizes) - sizes
+        position = (antonym_positions[0] * n_antonyms[1][rows] +
+                    antonym_positions[1]) * n_features[0][rows]
+        position = (position + feature_positions[0]) * n_features[1][rows]
+        df.index = pd.Index(starts[rows] + position + feature_positions[1])
+        return df
+
+
+def flatten(collections: pd.Series) -> tuple:
+    '''
+    Flattens a Series of collections as `Series.explode` does, empty
+    collections becoming a missing value.
+
+    Return:
+        (numpy.ndarray, numpy.ndarray) - Flat values and the offsets of the
+            values of each collection
+    '''
+    exploded = collections.reset_index(drop=True).explode()
+    counts = np.bincount(exploded.index.to_numpy(dtype=np.int64),
+                         minlength=len(collections))
+    offsets = np.zeros(len(collections) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return exploded.to_numpy(dtype=object), offsets
+
+
+def form_keys(codes: tuple, antonym_ids: np.ndarray,
+              feature_ids: np.ndarray) -> np.ndarray:
+    '''
+    Integer key of each (antonym, feature), from the factorized codes of the
+    flat antonyms and features.
+    '''
+    antonym_codes, feature_codes = codes
+    return antonym_codes[antonym_ids].astype(np.int64) * \
+        (feature_codes.max(initial=0) + 1) + feature_codes[feature_ids]
+
+
+def repeat_positions(counts: np.ndarray) -> tuple:
+    '''
+    Repeats each index `counts` times.
+
+    Return:
+        (numpy.ndarray, numpy.ndarray) - Repeated indices and the position of
+            each repetition
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    indices = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    return indices, np.arange(len(indices)) - starts[indices]
@@ -0,0 +1,192 @@
+import logging
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from seco.methods.antonym_riddle import isin
+from seco.profiling import stage
+from seco.readers.snapshot import fingerprint
+
+logger = logging.getLogger('riddles')
+# Bump when the state format changes, to force a full regeneration
+state_version = 1
+# Sources whose changes are not diffed, but force a full regeneration
+rebuild_sources = ['MorphoBR', 'ResourceStore', 'rules']
+score_columns = ['#Termo Log Probability', 'P1 Log Probability',
+                 'P2 Log Probability', 'Score']
+
+
+def term_keys(data: pd.DataFrame) -> np.ndarray:
+    '''
+    Hash of each row of the agglutination lexicon, identifying the term.
+    '''
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+def lemma_signatures(lexbase, lemmas: pd.Index) -> pd.Series:
+    '''
+    Hash of everything the candidates of each lemma depend on in the lexical
+    base: its antonyms, combined regardless of their order, and whether it is
+    in `words_with_antonymy`.
+    '''
+    edges = lexbase.antonymy_edges
+    edge_hashes = pd.util.hash_pandas_object(edges[['Word', 'Antonym']],
+                                             index=False).to_numpy()
+    codes, words = pd.factorize(edges['Word'])
+    signatures = np.zeros(len(words), dtype=np.uint64)
+    np.bitwise_xor.at(signatures, codes, edge_hashes)
+    signatures = pd.Series(signatures, index=words)
+    signatures = signatures.reindex(lemmas, fill_value=0).to_numpy()
+    antonymy = isin(lemmas.to_series(), lexbase.words_with_antonymy())
+    antonymy = antonymy.to_numpy()
+    signatures[antonymy] ^= np.uint64(1)
+    return pd.Series(signatures, index=lemmas)
+
+
+def load_state(filepath: Path, sources: dict):
+    '''
+    Reads the state saved by `save_state`, or None if there is none or it
+    was saved by another version.
+
+    Return:
+        (dict, list) - State and names of the sources changed since then
+    '''
+    filepath = Path(filepath)
+    if not filepath.exists():
+        logger.info(f'No previous state at \'{filepath}\'')
+        return None, list(sources)
+    try:
+        with filepath.open('rb') as file_:
+            header = pickle.load(file_)
+            if header['version'] != state_version:
+                logger.info(f'State \'{filepath}\' is from another version')
+                return None, list(sources)
+            changed = [name for name, source in sources.items()
+                       if header['sources'].get(name) != source]
+            if changed:
+                logger.info(f'Changed sources: {", ".join(changed)}')
+            return pickle.load(file_), changed
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError) as error:
+        logger.warning(f'Ignoring state \'{filepath}\': {error}')
+        return None, list(sources)
+
+
+def save_state(filepath: Path, sources: dict, state: dict) -> None:
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_filepath = filepath.with_suffix(f'.{os.getpid()}.tmp')
+    with tmp_filepath.open('wb') as file_:
+        pickle.dump({'version': state_version, 'sources': sources}, file_,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, file_, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filepath, filepath)
+    logger.info(f'Saved state \'{filepath}\'')
+
+
+def change_log(previous: pd.DataFrame, current: pd.DataFrame,
+               columns: list) -> pd.DataFrame:
+    '''
+    Riddles (candidates identified by `columns`) added to or removed from
+    the `previous` ones, marked as such in a `Change` column.
+    '''
+    previous_keys = pd.util.hash_pandas_object(previous[columns], index=False)
+    current_keys = pd.util.hash_pandas_object(current[columns], index=False)
+    added = current.loc[~current_keys.isin(previous_keys).to_numpy(), columns]
+    removed = previous.loc[~previous_keys.isin(current_keys).to_numpy(),
+                           columns]
+    changes = pd.concat([added, removed], ignore_index=True)
+    changes.insert(0, 'Change', ['added'] * added.shape[0] +
+                   ['removed'] * removed.shape[0])
+    logger.info(f'{added.shape[0]} riddles added, '
+                f'{removed.shape[0]} removed')
+    return changes
+
+
+def generate_incremental(generator, state_path: Path, sources: dict):
+    '''
+    Generates the same scored candidates as `generator.generate`, reusing
+    the candidates of the previous run saved in `state_path`.
+
+    Only the terms that are new in the agglutination lexicon, or whose
+    lemmas changed their antonyms in the lexical base, have their candidates
+    built again; the others are taken from the state. Frequencies are looked
+    up again for every candidate, which are then scored with the new global
+    totals. Changes to the sources in `rebuild_sources` regenerate every
+    candidate. The new candidates and state are saved for the next run.
+
+    Arguments:
+        generator: AntonymRiddleGenerator - Generator with the new resources
+        state_path: pathlib.Path - File of the state of the previous run
+        sources: dict - Path of each source, by reader name (and 'rules')
+    Return:
+        (pandas.DataFrame, pandas.DataFrame) - Scored candidates, and the
+            change log of riddles added and removed since the previous run
+    '''
+    data = generator.agglutlex.data
+    sources = {name: fingerprint(path) for name, path in sources.items()}
+    state, changed_sources = load_state(state_path, sources)
+    rebuild = bool(set(changed_sources).intersection(rebuild_sources))
+
+    with stage('diff inputs', rows_in=data.shape[0]) as record:
+        keys = term_keys(data)
+        lemmas = pd.Index(pd.unique(pd.concat([data['Lema1'],
+                                               data['Lema2']])))
+        signatures = lemma_signatures(generator.lexbase, lemmas)
+        previous = None if state is None else state['riddles']
+        if state is None or rebuild:
+            logger.info('Regenerating every candidate')
+            reuse = np.zeros(data.shape[0], dtype=bool)
+        else:
+            previous_signatures = state['signatures']
+            known = lemmas.isin(previous_signatures.index)
+            previous_signatures = previous_signatures.reindex(
+                lemmas, fill_value=0).to_numpy()
+            changed = lemmas[~known |
+                             (previous_signatures != signatures.to_numpy())]
+            logger.info(f'{len(changed)} lemmas changed their antonyms')
+            reuse = np.isin(keys, state['sizes'].index.to_numpy()) & \
+                ~data['Lema1'].isin(changed).to_numpy() & \
+                ~data['Lema2'].isin(changed).to_numpy()
+        logger.info(f'Reusing the candidates of {reuse.sum()} of '
+                    f'{data.shape[0]} agglutinations')
+        record['rows_out'] = int((~reuse).sum())
+
+    # Candidates of the new and changed terms
+    recompute = data.loc[~reuse, :].assign(_term=keys[~reuse])
+    recompute = recompute.drop_duplicates('_term')
+    candidates = generator.get_factorized_candidates(recompute)
+    sizes = pd.Series(candidates.sizes(),
+                      index=candidates.terms['_term'].to_numpy())
+    starts = sizes.cumsum() - sizes
+    df = generator.expand_allowed(candidates)
+    df['_position'] = df.index.to_numpy() - \
+        starts.loc[df['_term']].to_numpy()
+    sizes = sizes.reindex(recompute['_term'].to_numpy(), fill_value=0)
+    columns = [c for c in df.columns if not c.startswith('_')]
+
+    # Merge with the reused candidates, in the order of the lexicon
+    if reuse.any():
+        reused = np.unique(keys[reuse])
+        kept = previous.loc[previous['_term'].isin(reused), :]
+        kept = kept.drop_duplicates(['_term', '_position'])
+        df = pd.concat([kept[df.columns], df], ignore_index=True)
+        sizes = pd.concat([state['sizes'].loc[reused], sizes])
+    terms = pd.DataFrame({'_term': keys,
+                          '_row': np.arange(data.shape[0])})
+    row_sizes = sizes.loc[keys].to_numpy()
+    terms['_start'] = np.cumsum(row_sizes) - row_sizes
+    df = terms.merge(df, on='_term')
+    df.sort_values(['_row', '_position'], kind='stable', inplace=True)
+    df.index = pd.Index((df['_start'] + df['_position']).to_numpy())
+    df = df[columns + ['_term', '_position']]
+
+    riddles = generator.compute_candidate_scores(df)
+    changes = change_log(previous if previous is not None
+                         else riddles.iloc[:0], riddles, columns)
+    save_state(state_path, sources, {'riddles': riddles,
+                                     'sizes': sizes,
+                                     'signatures': signatures})
+    return riddles[columns + score_columns], changes
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from seco.readers.read_morphobr import pos_tags
+
+default_rules = Path(__file__).parent / 'rules.tsv'
+
+
+def load_rules(filepath: Path = None) -> np.ndarray:
+    '''
+    Reads the pairs of parts of speech allowed for P1 and P2 from a TSV file
+    with `P1` and `P2` columns (by default, the rules shipped with SECO).
+
+    Return:
+        numpy.ndarray - Boolean matrix indexed by the P1 and P2 part of speech
+            codes (see `seco.readers.read_morphobr.pos_code`)
+    '''
+    if filepath is None:
+        filepath = default_rules
+    with Path(filepath).open(encoding='utf-8') as file_:
+        rules = pd.read_csv(file_, sep='\t', comment='#')
+    unknown = set(rules['P1']).union(rules['P2']).difference(pos_tags)
+    if unknown:
+        raise ValueError(f'Unknown parts of speech {sorted(unknown)} in '
+                         f'\'{filepath}\', expected {pos_tags}')
+    allowed = np.zeros((len(pos_tags) + 1, len(pos_tags) + 1), dtype=bool)
+    allowed[[pos_tags.index(p) for p in rules['P1']],
+            [pos_tags.index(p) for p in rules['P2']]] = True
+    return allowed
@@ -0,0 +1,97 @@
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+
+class AliasTable(object):
+    '''
+    Walker's alias table for drawing indices with probability proportional
+    to `weights` in constant time per draw, after a linear-time build.
+    '''
+
+    def __init__(self, weights) -> None:
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.size == 0 or weights.sum() <= 0:
+            raise ValueError('Alias table needs at least one positive weight')
+        size = weights.size
+        self.prob = weights * size / weights.sum()
+        self.alias = np.arange(size)
+
+        small = list(np.flatnonzero(self.prob < 1))
+        large = list(np.flatnonzero(self.prob >= 1))
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.alias[less] = more
+            self.prob[more] -= 1 - self.prob[less]
+            if self.prob[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Leftovers are only off by rounding errors
+        self.prob[small + large] = 1
+
+    def sample(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        columns = rng.integers(self.prob.size, size=n)
+        keep = rng.random(n) < self.prob[columns]
+        return np.where(keep, columns, self.alias[columns])
+
+
+class RiddlePool(object):
+    '''
+    Pool of scored riddle candidates to select riddles from, either the `k`
+    best ones or `k` draws weighted by `exp(Score)`. The alias table for the
+    weighted draws and the index of the riddles of each term are built on
+    first use and reused afterwards. Pools can be shared between threads.
+    '''
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.data = df.reset_index(drop=True)
+        self.table = None
+        self.term_index = None
+        self.rng = np.random.default_rng()
+        self.lock = Lock()
+
+    def top(self, k: int) -> pd.DataFrame:
+        return self.data.nlargest(k, 'Score')
+
+    def for_term(self, term: str, k: int = None) -> pd.DataFrame:
+        '''
+        Riddles for the agglutinated `term`, best scored first (only the `k`
+        best ones, if given).
+        '''
+        with self.lock:
+            if self.term_index is None:
+                self.term_index = self.data.groupby('#Termo').indices
+        positions = self.term_index.get(term, [])
+        riddles = self.data.iloc[positions]
+        if k is None:
+            return riddles.sort_values(by='Score', ascending=False)
+        return riddles.nlargest(k, 'Score')
+
+    def sample(self, k: int, seed: int = None) -> pd.DataFrame:
+        '''
+        Draws `k` riddles (with replacement) with probability proportional to
+        `exp(Score)`. A `seed` makes the draws reproducible. An empty pool
+        draws no riddles.
+        '''
+        if self.data.shape[0] == 0:
+            return self.data.iloc[:0]
+        with self.lock:
+            if self.table is None:
+                scores = self.data['Score'].to_numpy()
+                # Shifting by the maximum avoids underflow of exp
+                self.table = AliasTable(np.exp(scores - scores.max()))
+            if seed is None:
+                positions = self.table.sample(k, self.rng)
+        if seed is not None:
+            positions = self.table.sample(k, np.random.default_rng(seed))
+        return self.data.iloc[positions]
+
+    def select(self, k: int = 1, mode: str = 'top',
+               seed: int = None) -> pd.DataFrame:
+        if mode == 'top':
+            return self.top(k)
+        elif mode == 'sample':
+            return self.sample(k, seed)
+        raise ValueError(f'Unknown selection mode \'{mode}\'')
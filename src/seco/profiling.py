@@ -0,0 +1,171 @@
+import cProfile
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger('riddles')
+# Profiler of the pipeline stages, if profiling is enabled
+_profiler = None
+
+
+class Profiler(object):
+    '''
+    Records the wall and CPU time, memory and row counts of pipeline stages.
+    Stages can be nested; memory is traced with `tracemalloc`, so the peak of
+    a stage includes the peaks of its sub-stages. The stage named
+    `cprofile_stage`, if any, is also run under `cProfile`.
+    '''
+
+    def __init__(self, cprofile_stage: str = None) -> None:
+        self.cprofile_stage = cprofile_stage
+        self.cprofiles = list()
+        self.records = list()
+        self.stack = list()
+        self.origin = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        '''
+        Context of a stage. Yields its record, where the stage can add
+        fields such as `rows_in` and `rows_out`.
+        '''
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            self.stack[-1]['_peak'] = max(self.stack[-1]['_peak'], peak)
+        tracemalloc.reset_peak()
+        record = {'name': name, 'depth': len(self.stack), **fields}
+        record['_peak'] = 0
+        self.stack.append(record)
+
+        profile = cProfile.Profile() if name == self.cprofile_stage else None
+        start, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.cprofiles.append((name, profile))
+            end = time.perf_counter()
+            record['start_s'] = start - self.origin
+            record['wall_s'] = end - start
+            record['cpu_s'] = time.process_time() - cpu
+
+            end_current, peak = tracemalloc.get_traced_memory()
+            peak = max(record.pop('_peak'), peak)
+            tracemalloc.reset_peak()
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1]['_peak'] = max(self.stack[-1]['_peak'], peak)
+            record['peak_memory_mb'] = peak / 2 ** 20
+            record['memory_delta_mb'] = (end_current - current) / 2 ** 20
+            record['max_rss_mb'] = max_rss_mb()
+            if record.get('rows_in') and record.get('rows_out') is not None:
+                record['fanout'] = record['rows_out'] / record['rows_in']
+            self.records.append(record)
+
+    def save(self, filepath: Path, format_: str = 'json') -> None:
+        '''
+        Saves the stage records to `filepath`, either as a JSON list of
+        records or in the Chrome trace event format (`format_='chrome'`),
+        and the `cProfile` statistics next to it.
+        '''
+        records = sorted(self.records, key=lambda r: r['start_s'])
+        if format_ == 'chrome':
+            trace = {'traceEvents': [{'name': r['name'],
+                                      'ph': 'X',
+                                      'ts': r['start_s'] * 1e6,
+                                      'dur': r['wall_s'] * 1e6,
+                                      'pid': 0,
+                                      'tid': 0,
+                                      'args': r}
+                                     for r in records]}
+        elif format_ == 'json':
+            trace = {'stages': records}
+        else:
+            raise ValueError(f'Unknown profile format \'{format_}\'')
+        with Path(filepath).open('w', encoding='utf-8') as file_:
+            json.dump(trace, file_, indent=4, default=str)
+        logger.info(f'Saved profile to \'{filepath}\'')
+
+        if self.cprofile_stage is not None and not self.cprofiles:
+            names = ', '.join(dict.fromkeys(r['name'] for r in records))
+            logger.warning(f'No stage named \'{self.cprofile_stage}\' ran, '
+                           f'so no cProfile statistics were saved. Stages '
+                           f'recorded: {names}')
+        for name, profile in self.cprofiles:
+            stats_path = f'{filepath}.{name.replace(" ", "_")}.prof'
+            profile.dump_stats(stats_path)
+            logger.info(f'Saved cProfile statistics to \'{stats_path}\'')
+
+
+def max_rss_mb() -> float:
+    '''
+    Peak resident set size of the process, or None where the platform does
+    not report it.
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def enable(cprofile_stage: str = None) -> Profiler:
+    global _profiler
+    _profiler = Profiler(cprofile_stage)
+    return _profiler
+
+
+def disable() -> Profiler:
+    global _profiler
+    profiler, _profiler = _profiler, None
+    tracemalloc.stop()
+    return profiler
+
+
+@contextmanager
+def stage(name: str, **fields):
+    '''
+    Profiles a stage if profiling is enabled (see `Profiler.stage`).
+    '''
+    if _profiler is None:
+        yield dict(fields)
+    else:
+        with _profiler.stage(name, **fields) as record:
+            yield record
+
+
+def profiled(name: str):
+    '''
+    Decorator profiling a function as a stage, counting the rows of its first
+    DataFrame argument and of its result.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            frames = [a for a in args if hasattr(a, 'shape')]
+            rows_in = frames[0].shape[0] if frames else None
+            with stage(name, rows_in=rows_in) as record:
+                result = func(*args, **kwargs)
+                if hasattr(result, 'shape'):
+                    record['rows_out'] = result.shape[0]
+            return result
+        return wrapper
+    return decorator
@@ -1,6 +1,8 @@
-from .read_agglutlex import AgglutLex
-from .read_frequencies import FrequencyLexicon
-from .read_kb_triples import LexicalBase
-from .read_morphobr import MorphoBR
-from .read_seco import read_seco
-from .read_liwc import LIWC
\ No newline at end of file
+from .read_agglutlex import AgglutLex
+from .read_frequencies import FrequencyLexicon
+from .read_kb_triples import LexicalBase
+from .read_morphobr import CompactMorphoBR, MorphoBR
+from .read_seco import read_seco
+from .read_liwc import LIWC
+from .snapshot import read_cached
+from .store import ResourceStore
\ No newline at end of file
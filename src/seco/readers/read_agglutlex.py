@@ -1,9 +1,11 @@
 import logging
 from pathlib import Path
 import sys
-import pyphen
+import numpy as np
 import pandas as pd
 
+from .syllables import Syllabifier, agglutination_in_syllable
+
 
 logger = logging.getLogger('riddles')
 
@@ -15,11 +17,15 @@ class AgglutLex(object):
     other meaningful words as substrings.
     '''
 
+    # Bump when parsing changes, to invalidate cached snapshots
+    version = 3
+
     def __init__(self, data):
         self.data = data
+        self.term_index = None
 
     @classmethod
-    def read(cls, filepath):
+    def read(cls, filepath, workers=1, syllable_cache=None):
         '''
         Read a TSV file. The file should contain 5 columns:
             #Termo - Whole agglutinated word
@@ -29,6 +35,8 @@ class AgglutLex(object):
             Lema2 - Lemma of the second subword
 
         The words are processed as being written in European Portuguese.
+        Terms are syllabified by `workers` processes, reusing and updating
+        the syllabification memo at `syllable_cache`, if given.
         '''
         logger.info(f'Loading file \'{filepath}\'')
         with filepath.open(encoding='utf-8') as file_:
@@ -37,19 +45,38 @@ class AgglutLex(object):
 
         # Find if agglutination coincides with a syllable
         logger.info('Processing syllables')
-        dic = pyphen.Pyphen(lang='pt_PT')
-        # triples (P1, P2, syllables)
-        syl_agglu_pos = zip(df['P1'].str.len(),
-                            df['Termo#'].str.len() - df['P2'].str.len(),
-                            df['Termo#'].apply(dic.positions))
-        df['Agglutination in syllable'] = [agglu_p1 in syl_pos or agglu_p2 in syl_pos
-                                           for agglu_p1, agglu_p2, syl_pos in syl_agglu_pos]
+        syllabifier = Syllabifier(lang='pt_PT', cache_path=syllable_cache)
+        df['Agglutination in syllable'] = agglutination_in_syllable(
+            df['#Termo'], df['P1'], df['P2'], syllabifier, workers=workers)
+        syllabifier.save()
         logger.info('Agglutination Lexicon ready')
         return AgglutLex(df)
 
     def filter_words(self, words):
-        indices = self.data['#Termo'].isin(words)
-        return self.data.loc[indices, :]
+        '''
+        Rows of the agglutinated `words`, looked up in an index of the rows of
+        each term, built on the first call.
+        '''
+        if self.term_index is None:
+            self.term_index = self.data.groupby('#Termo').indices
+        positions = [self.term_index[w] for w in set(words)
+                     if w in self.term_index]
+        positions = np.sort(np.concatenate(positions)) if positions \
+            else np.array([], dtype=np.int64)
+        return self.data.iloc[positions]
+
+    def vocabulary(self):
+        '''
+        Parts and lemmas of the agglutinations that can make riddles, those
+        whose agglutination coincides with a syllable.
+
+        Return:
+            (frozenset, frozenset) - Words (P1, P2) and lemmas (Lema1, Lema2)
+        '''
+        df = self.data.loc[self.data['Agglutination in syllable'], :]
+        words = frozenset(df['P1']).union(df['P2'])
+        lemmas = frozenset(df['Lema1']).union(df['Lema2'])
+        return words, lemmas
 
 
 if __name__ == '__main__':
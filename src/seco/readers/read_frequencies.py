@@ -1,25 +1,110 @@
 import logging
 import sys
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger('riddles')
 
 
 class FrequencyLexicon(object):
-    def __init__(self, data):
-        self.data = data
+    '''
+    Word frequencies from a corpus. Words are kept only as a sorted array
+    of 64-bit hashes with an aligned array of integer counts, so that
+    lookups are vectorized binary searches and both arrays can be
+    memory-mapped from disk (see `save` and `load`).
+    '''
+
+    # Bump when parsing changes, to invalidate cached snapshots
+    version = 3
+
+    def __init__(self, hashes, counts):
+        self.hashes = hashes
+        self.counts = counts
+        self.total = int(counts.sum())
 
     @classmethod
-    def read(cls, filepath):
+    def from_frequencies(cls, frequencies):
+        '''
+        Lexicon of a Series of word frequencies, indexed by word. Counts of
+        repeated words are added up.
+        '''
+        counts = frequencies.groupby(hash_words(frequencies.index)).sum()
+        return cls(counts.index.to_numpy(dtype=np.uint64),
+                   counts.to_numpy(dtype=np.int64))
+
+    @staticmethod
+    def parse(filepath):
+        '''
+        Reads a TSV file of frequencies and words.
+
+        Return:
+            pandas.Series - Frequency of each word, indexed by word
+        '''
         logger.info(f'Loading file \'{filepath}\'')
         with filepath.open(encoding='utf-8') as file_:
-            df = pd.read_csv(file_, sep='\t',
-                             names=['Frequency', 'Word'],
-                             index_col='Word').squeeze()
-        logger.info(f'{df.shape[0]} items loaded')
+            frequencies = pd.read_csv(file_, sep='\t',
+                                      names=['Frequency', 'Word'],
+                                      index_col='Word').squeeze()
+        logger.info(f'{frequencies.shape[0]} items loaded')
+        return frequencies
+
+    @classmethod
+    def read(cls, filepath):
+        lexicon = cls.from_frequencies(cls.parse(filepath))
         logger.info(f'Frequency Lexicon ready')
-        return FrequencyLexicon(df)
+        return lexicon
+
+    def save(self, dirpath):
+        '''
+        Saves the hash and count arrays to `dirpath`, to be loaded by `load`.
+        '''
+        dirpath.mkdir(parents=True, exist_ok=True)
+        np.save(dirpath / 'hashes.npy', self.hashes)
+        np.save(dirpath / 'counts.npy', self.counts)
+
+    @classmethod
+    def load(cls, dirpath, mmap=True):
+        '''
+        Loads arrays saved by `save`, memory-mapping them unless `mmap` is
+        false.
+        '''
+        mmap_mode = 'r' if mmap else None
+        hashes = np.load(dirpath / 'hashes.npy', mmap_mode=mmap_mode)
+        counts = np.load(dirpath / 'counts.npy', mmap_mode=mmap_mode)
+        logger.info(f'Frequency Lexicon with {hashes.shape[0]} items '
+                    f'loaded from \'{dirpath}\'')
+        return cls(hashes, counts)
+
+    def positions(self, words):
+        '''
+        Positions of `words` in the count array, -1 for unknown words.
+        '''
+        hashes = hash_words(words)
+        if self.hashes.shape[0] == 0:
+            return np.full(hashes.shape[0], -1)
+        positions = np.searchsorted(self.hashes, hashes)
+        positions[positions >= self.hashes.shape[0]] = 0
+        return np.where(self.hashes[positions] == hashes, positions, -1)
+
+    def lookup(self, words, smoothing=False):
+        '''
+        Frequency of each of the `words`, 0 for words not in the corpus. If
+        `smoothing` is true, 1 is added to every frequency.
+
+        Arguments:
+            words: pandas.Series - Words to retrieve frequency
+            smoothing: boolean - Wheter to perform smoothing or not
+        Return:
+            numpy.ndarray - Frequency of each word, aligned with `words`
+        '''
+        positions = self.positions(words)
+        found = positions >= 0
+        freqs = np.zeros(positions.shape[0], dtype=np.int64)
+        freqs[found] = self.counts[positions[found]]
+        if smoothing:
+            freqs += 1
+        return freqs
 
     def get_frequencies(self, words, smoothing=False):
         '''
@@ -33,21 +118,20 @@ class FrequencyLexicon(object):
         Return:
             pandas.Series - Words as index and frequency as value
         '''
-        words = words.copy()
-        words.drop_duplicates(inplace=True)
-        has_freq = words.isin(self.data.index)
-        words_with_freq = words.loc[has_freq]
-        words_freq = self.data[words_with_freq]
+        words = words.drop_duplicates()
+        freqs = pd.Series(self.lookup(words, smoothing), index=words.to_numpy())
+        if not smoothing:
+            freqs = freqs.loc[self.positions(words) >= 0]
+        return freqs
 
-        if smoothing:
-            words_freq += 1 # Add count
-            words_wo_freq = words.loc[~has_freq]
-            words_no_freq = pd.Series(1, index=words_wo_freq) # New words with frequency 1
-            words_freq = pd.concat([words_freq, words_no_freq])
-        return words_freq
+
+def hash_words(words):
+    return pd.util.hash_array(np.asarray(words, dtype=object))
 
 
 if __name__ == '__main__':
     filepath = Path(sys.argv[1])
     reader = FrequencyLexicon.read(filepath)
-    print(reader.data)
+    print(f'{reader.counts.shape[0]} words, {reader.total} occurrences')
+    print(reader.get_frequencies(pd.Series(['de', 'casa', 'kjfj']),
+                                 smoothing=True))
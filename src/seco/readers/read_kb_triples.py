@@ -1,7 +1,9 @@
 import logging
 import sys
+import time
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger('riddles')
@@ -12,56 +14,165 @@ antonymy_relations = ['ANTONIMO_V_DE',
 
 
 class LexicalBase(object):
+    # Bump when parsing changes, to invalidate cached snapshots
+    version = 4
+
     def __init__(self, data: pd.DataFrame) -> None:
         self.data = data
+        self.antonymy_edges = self._build_antonymy_edges(data)
+        self.antonymy = self._build_antonymy_index(self.antonymy_edges)
+        is_antonymy = data['Relation'].isin(antonymy_relations)
+        self.antonymy_words = pd.Index(
+            np.asarray(data.loc[is_antonymy, 'Word 2'].unique(), dtype=object))
+
+    @staticmethod
+    def _build_antonymy_edges(data: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Builds the table of antonymy relations in both directions, with one
+        row per (Word, Antonym) pair and its max resource Weight.
+        '''
+        is_antonymy = data['Relation'].isin(antonymy_relations)
+        edges = data.loc[is_antonymy, ['Word 1', 'Word 2', 'Resources']]
+        reverse = edges.rename(columns={'Word 1': 'Word 2',
+                                        'Word 2': 'Word 1'})
+        edges = pd.concat([edges, reverse], ignore_index=True)
+        weights = edges.groupby(['Word 1', 'Word 2'],
+                                observed=True)['Resources'].max()
+        weights.index.names = ['Word', 'Antonym']
+        edges = weights.rename('Weight').astype('int64').reset_index()
+        edges[['Word', 'Antonym']] = edges[['Word', 'Antonym']].astype(object)
+        return edges
+
+    @staticmethod
+    def _build_antonymy_index(edges: pd.DataFrame) -> dict:
+        '''
+        Builds an adjacency index of the antonymy edges:
+        word -> {antonym: weight}.
+        '''
+        index = dict()
+        for word, antonym, weight in zip(edges['Word'], edges['Antonym'],
+                                         edges['Weight'].tolist()):
+            index.setdefault(word, dict())[antonym] = weight
+        return index
 
     @classmethod
-    def read(cls, filepath: Path) -> 'LexicalBase':
+    def read(cls, filepath: Path, words: frozenset = None,
+             relations: list = None,
+             chunk_size: int = 100000) -> 'LexicalBase':
+        '''
+        Reads a file of Onto.PT triples, streaming it `chunk_size` lines at a
+        time. Words and relations are dictionary encoded as they are parsed,
+        into categorical columns whose categories are sorted.
+
+        Arguments:
+            filepath: pathlib.Path - Triples file, with lines such as
+                'word1 RELATION word2<tab>resources'
+            words: frozenset - Keep only the relations of these words
+            relations: list - Keep only these relations
+            chunk_size: int - Lines parsed at a time
+        Return:
+            LexicalBase - Lexical base with the kept triples
+        '''
         logger.info(f'Loading file \'{filepath}\'')
+        start = time.perf_counter()
+        word_ids, relation_ids = dict(), dict()
+        columns = {'Word 1': list(), 'Relation': list(),
+                   'Word 2': list(), 'Resources': list()}
+        rows = 0
         with filepath.open(encoding='utf-8') as file_:
-            df = pd.read_csv(file_, sep='\t',
-                             names=['Triple', 'Resources'])
-            final_df = pd.DataFrame(df['Triple'].str.split(' ').to_list(),
-                                    columns=['Word 1', 'Relation', 'Word 2'])
-            final_df['Resources'] = df['Resources']
+            for chunk in pd.read_csv(file_, sep=r'\s+', header=None,
+                                     names=list(columns),
+                                     dtype={'Word 1': 'category',
+                                            'Relation': 'category',
+                                            'Word 2': 'category',
+                                            'Resources': np.int32},
+                                     na_filter=False,
+                                     chunksize=chunk_size):
+                rows += chunk.shape[0]
+                keep = np.ones(chunk.shape[0], dtype=bool)
+                if relations is not None:
+                    keep &= chunk['Relation'].isin(relations).to_numpy()
+                if words is not None:
+                    keep &= (chunk['Word 1'].isin(words) |
+                             chunk['Word 2'].isin(words)).to_numpy()
+                chunk = chunk.loc[keep, :]
+                for column, ids in [('Word 1', word_ids),
+                                    ('Relation', relation_ids),
+                                    ('Word 2', word_ids)]:
+                    columns[column].append(_encode(chunk[column], ids))
+                columns['Resources'].append(chunk['Resources'].to_numpy())
+
+        final_df = pd.DataFrame({
+            'Word 1': _categorical(columns['Word 1'], word_ids),
+            'Relation': _categorical(columns['Relation'], relation_ids),
+            'Word 2': _categorical(columns['Word 2'], word_ids),
+            'Resources': np.concatenate(columns['Resources'])
+        })
+        elapsed = time.perf_counter() - start
+        logger.info(f'{rows} triples parsed in {elapsed:.1f}s '
+                    f'({rows / max(elapsed, 1e-9):.0f} rows/s)')
         logger.info(f'{final_df.shape[0]} items loaded')
         logger.info(f'Lexical Base ready')
         return LexicalBase(final_df)
 
-    def words_with_antonymy(self) -> pd.Series:
-        is_antonymy = self.data['Relation'].isin(antonymy_relations)
-        words_with_antonymy = self.data.loc[is_antonymy, 'Word 2'].unique()
-        return words_with_antonymy
+    def words_with_antonymy(self) -> pd.Index:
+        return self.antonymy_words
 
     def antonyms_of(self, word: str) -> set:
-        is_antonymy = self.data['Relation'].isin(antonymy_relations)
-        is_word_1 = self.data['Word 1'] == word
-        is_word_2 = self.data['Word 2'] == word
+        return set(self.antonymy.get(word, ()))
+
+    def antonyms_of_many(self, words: pd.Series) -> pd.Series:
+        '''
+        Batch version of `antonyms_of`.
 
-        word_1_ant = self.data.loc[is_antonymy & is_word_1, 'Word 2'].to_list()
-        word_2_ant = self.data.loc[is_antonymy & is_word_2, 'Word 1'].to_list()
-        return set(word_1_ant + word_2_ant)
+        Arguments:
+            words: pandas.Series - Words to retrieve antonyms
+        Return:
+            pandas.Series - Set of antonyms for each word, aligned with `words`
+        '''
+        return pd.Series([self.antonyms_of(w) for w in words],
+                         index=words.index, dtype=object)
 
     def get_weight(self, word1: str, word2: str) -> int:
-        is_antonymy = self.data['Relation'].isin(antonymy_relations)
-        is_word_11 = self.data['Word 1'] == word1
-        is_word_12 = self.data['Word 2'] == word1
-        is_word_21 = self.data['Word 1'] == word2
-        is_word_22 = self.data['Word 2'] == word2
-
-        rel_word12 = self.data.loc[is_antonymy &
-                                   is_word_11 &
-                                   is_word_22, 'Resources']
-        rel_word21 = self.data.loc[is_antonymy &
-                                   is_word_21 &
-                                   is_word_12, 'Resources']
-
-        return_value = 0
-        if not rel_word12.empty:
-            return_value = max(rel_word12.to_list())
-        if not rel_word21.empty:
-            return_value = max(rel_word21.to_list())
-        return return_value
+        return self.antonymy.get(word1, dict()).get(word2, 0)
+
+    def weights_of_pairs(self, words1: pd.Series, words2: pd.Series) -> pd.Series:
+        '''
+        Batch version of `get_weight`.
+
+        Arguments:
+            words1: pandas.Series - First word of each pair
+            words2: pandas.Series - Second word of each pair
+        Return:
+            pandas.Series - Antonymy weight of each pair (0 if the pair is not
+                related), aligned with `words1`
+        '''
+        weights = [self.get_weight(w1, w2) for w1, w2 in zip(words1, words2)]
+        return pd.Series(weights, index=words1.index, dtype='int64')
+
+
+def _encode(column: pd.Series, ids: dict) -> np.ndarray:
+    '''
+    Codes of a categorical column in the dictionary `ids`, to which its new
+    categories are added.
+    '''
+    column = column.cat.remove_unused_categories()
+    mapping = np.array([ids.setdefault(c, len(ids))
+                        for c in column.cat.categories], dtype=np.int32)
+    return mapping[column.cat.codes.to_numpy()]
+
+
+def _categorical(codes: list, ids: dict) -> pd.Categorical:
+    '''
+    Categorical of the chunks of `codes` in the dictionary `ids`, with its
+    categories sorted.
+    '''
+    categories = np.array(list(ids), dtype=object)
+    order = np.argsort(categories, kind='stable')
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    codes = np.concatenate(codes) if codes else np.array([], dtype=np.int32)
+    return pd.Categorical.from_codes(rank[codes], categories[order])
 
 
 if __name__ == '__main__':
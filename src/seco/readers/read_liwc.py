@@ -1,12 +1,39 @@
 from pathlib import Path
 from sys import argv
 
+import pandas as pd
+
+# Trie node keys of the tags of a whole word and of a prefix (word*) entry,
+# which cannot clash with the characters of a word
+_EXACT = 0
+_PREFIX = 1
+
 
 class LIWC(object):
+    '''
+    LIWC dictionary. Entries are either whole words or prefixes with a
+    trailing `*`, matching every word that starts with them. Entries are kept
+    in a character trie, so that a word is resolved in O(word length): an
+    exact entry takes precedence, and otherwise the longest matching prefix
+    entry is used.
+    '''
+
+    # Bump when parsing changes, to invalidate cached snapshots
+    version = 1
+
     def __init__(self, tags, words) -> None:
         self.id2tags = tags
         self.tags2id = {tags[id_]: id_ for id_ in tags}
         self.words = words
+        self.trie = dict()
+        for entry, ids in words.items():
+            key = _EXACT
+            if entry.endswith('*'):
+                entry, key = entry[:-1], _PREFIX
+            node = self.trie
+            for char in entry:
+                node = node.setdefault(char, dict())
+            node[key] = tuple(ids)
 
     @classmethod
     def read(cls, filepath: Path) -> 'LIWC':
@@ -30,12 +57,50 @@ class LIWC(object):
                     word2id[word] = tags
         return LIWC(id2tags, word2id)
 
+    def lookup(self, word):
+        '''
+        Tag ids of the entry matching `word`, or None if there is none.
+        '''
+        node = self.trie
+        match = None
+        for char in word:
+            match = node.get(_PREFIX, match)
+            node = node.get(char)
+            if node is None:
+                return match
+        return node.get(_EXACT, node.get(_PREFIX, match))
+
     def get_tags(self, word):
-        if word in self.words:
-            return [self.id2tags[t] for t in self.words[word]]
+        ids = self.lookup(word)
+        if ids is not None:
+            return [self.id2tags[t] for t in ids]
         else:
             return None
 
+    def get_tags_many(self, words: pd.Series) -> pd.Series:
+        '''
+        Tags of each of the `words` as a bitset, where bit `i` is set if the
+        word has the tag with id `i` (0 if the word has no entry). Each distinct
+        word is looked up once.
+
+        Arguments:
+            words: pandas.Series - Words to tag
+        Return:
+            pandas.Series - Tag bitset of each word, aligned with `words`
+        '''
+        bitsets = dict()
+        for word in pd.unique(words):
+            ids = self.lookup(word) if isinstance(word, str) else None
+            bitsets[word] = sum(1 << t for t in set(ids)) if ids else 0
+        return pd.Series([bitsets[w] for w in words],
+                         index=words.index, dtype=object)
+
+    def tags_of(self, bitset: int) -> list:
+        '''
+        Tags in a bitset returned by `get_tags_many`.
+        '''
+        return [tag for id_, tag in self.id2tags.items() if bitset >> id_ & 1]
+
 
 if __name__ == '__main__':
     filepath = Path(argv[1])
@@ -1,82 +1,415 @@
 import logging
-from re import match
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import sys
-from itertools import product
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger('riddles')
+# Parts of speech of the features, coded by their position in this list
+pos_tags = ['A', 'ADV', 'N', 'V']
+
+
+def pos_code(feature):
+    '''
+    Code of the part of speech of a feature string (e.g. 'V+PRS+3+SG'), its
+    position in `pos_tags`, or `len(pos_tags)` for any other feature.
+    '''
+    if isinstance(feature, str):
+        pos = feature.split('+')[0]
+        if pos in pos_tags:
+            return pos_tags.index(pos)
+    return len(pos_tags)
 
 
 class MorphoBR(object):
+    '''
+    MorphoBR entries, looked up in batches through keyed tables: the
+    features of each (word, lemma) entry, and the word of each (lemma,
+    feature) lexical form.
+    '''
+    # Bump when parsing changes, to invalidate cached snapshots
+    version = 3
+
     def __init__(self, data):
-        self.word_to_feat = data
-        self.feat_to_word = {(l, f): w for (w, l) in data
-                             for f in data[(w, l)]}
-        self.vocab = {w for (w, _) in data}
+        '''
+        Arguments:
+            data: dict - Set of features of each (word, lemma) entry
+        '''
+        words = np.array([w for (w, _) in data], dtype=object)
+        lemmas = np.array([l for (_, l) in data], dtype=object)
+        self.entries = pd.MultiIndex.from_arrays([words, lemmas],
+                                                 names=['Word', 'Lemma'])
+        self.entry_feats = np.empty(len(data), dtype=object)
+        self.entry_feats[:] = list(data.values())
+        self.entry_pos = None
+        self.vocab = self.entries.levels[0]
+
+        # (lemma, feature) -> word, keeping the last word of repeated keys
+        forms = self.form_table()
+        forms.drop_duplicates(['Lemma', 'Features'], keep='last',
+                              inplace=True)
+        self.forms = pd.Series(
+            forms['Word'].to_numpy(),
+            index=pd.MultiIndex.from_frame(forms[['Lemma', 'Features']]))
+        self.all_forms = None
 
     @classmethod
-    def read(cls, dirpath):
+    def read(cls, dirpath, workers=1, words=None, lemmas=None):
+        '''
+        Reads the adjectives, adverbs, nouns and verbs folders of MorphoBR.
+        With `workers` > 1, files are parsed in a process pool and the
+        per-file results merged in the same order as the serial reader.
+        With `words` or `lemmas`, only the entries of those words or lemmas
+        are kept.
+        '''
         logger.info(f'Loading MorphoBR from directory {dirpath}')
-        folders = ['adjectives', 'adverbs',
-                   'nouns', 'verbs']
+        filepaths = _list_files(dirpath)
         morphology_dict = dict()
-        for folder in dirpath.iterdir():
-            if folder.name in folders:
-                for filepath in folder.iterdir():
-                    with filepath.open('rU', encoding='utf-8') as file_:
-                        for line in file_:
-                            word, features = line.rstrip().split('\t')
-                            split_feats = features.split('+')
-                            lemma = split_feats[0]
-                            feats = '+'.join(split_feats[1:])
-
-                            if (word, lemma) not in morphology_dict:
-                                morphology_dict[(word, lemma)] = set()
-                            morphology_dict[(word, lemma)].add(feats)
+        if workers > 1:
+            logger.info(f'Parsing {len(filepaths)} files with {workers} workers')
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=(words, lemmas)) as executor:
+                for file_dict in executor.map(_read_file, filepaths):
+                    for key, feats in file_dict.items():
+                        if key not in morphology_dict:
+                            morphology_dict[key] = set()
+                        morphology_dict[key].update(feats)
+        else:
+            for filepath in filepaths:
+                _parse_file(filepath, morphology_dict, words, lemmas)
         logger.info(f'Loaded {len(morphology_dict)} words')
         return cls(morphology_dict)
 
+    def form_table(self):
+        '''
+        Table of every (Lemma, Features, Word) lexical form, in the order of
+        the entries.
+        '''
+        counts = [len(feats) for feats in self.entry_feats]
+        return pd.DataFrame({
+            'Lemma': np.repeat(self.entries.get_level_values('Lemma'), counts),
+            'Features': [f for feats in self.entry_feats for f in feats],
+            'Word': np.repeat(self.entries.get_level_values('Word'), counts)})
+
+    def get_entry_pos(self, positions):
+        '''
+        Parts of speech of the features of the entries at `positions`, which
+        must all be found (not -1). They are projected from the features on
+        the first lookup of each entry, and kept for the following ones.
+        '''
+        if self.entry_pos is None:
+            self.entry_pos = np.full(len(self.entry_feats), None, dtype=object)
+        missing = np.unique(positions[positions >= 0])
+        missing = missing[np.equal(self.entry_pos[missing], None)]
+        for position in missing:
+            self.entry_pos[position] = {f.split('+')[0]
+                                        for f in self.entry_feats[position]}
+        return self.entry_pos[positions]
+
+    def get_all_forms(self):
+        '''
+        Every word of each (lemma, feature) lexical form, built on the first
+        call and kept for the following ones.
+        '''
+        if self.all_forms is None:
+            self.all_forms = self.form_table().groupby(
+                ['Lemma', 'Features'], sort=False)['Word'].agg(list)
+        return self.all_forms
+
     def get_feats(self, words, lemmas, only_pos=False):
-        def mapping(value):
-            return_value = set()
-            if value in self.word_to_feat:
-                return_value = self.word_to_feat[value]
-                if only_pos:
-                    return_value = {match(r'(\w+)(?:\+|$)', f).group(1)
-                                    for f in return_value}
-            return return_value
-        tuples = pd.Series(zip(words, lemmas), index=words.index)
-        feats = tuples.map(mapping)
-        return feats
-
-    # def get_lexical_forms(self, lemmas, features):
-    #     forms = list()
-    #     used_features = list()
-    #     for lemma, feats in zip(lemmas, features):
-    #         frs = list()
-    #         fts = list()
-    #         for t in product(lemma, feats):
-    #             if t in self.feat_to_word:
-    #                 frs.append(self.feat_to_word[t])
-    #                 fts.append(t[1])
-    #         if frs:
-    #             forms.append(frs)
-    #             used_features.append(fts)
-    #         else:
-    #             # No lexical form found, use the lemma
-    #             forms.append(lemma)
-    #             used_features.append(feats)
-    #     return pd.Series(forms, index=lemmas.index), pd.Series(used_features, index=lemmas.index)
-
-    def get_lexical_forms(self, lemmas, features):
-        def mapping(value):
-            if value in self.feat_to_word:
-                return self.feat_to_word[value]
-            return value[0]  # No lexical form found, use lemma
-        tuples = pd.Series(zip(lemmas, features))
-        return tuples.map(mapping)
+        '''
+        Features of each (word, lemma) pair, or only their parts of speech.
+
+        Arguments:
+            words: pandas.Series - Words
+            lemmas: pandas.Series - Lemma of each word
+            only_pos: bool - Return the parts of speech of the features
+        Return:
+            pandas.Series - Set of features of each pair (empty for pairs
+                not in MorphoBR), aligned with `words`
+        '''
+        query = pd.MultiIndex.from_arrays([np.asarray(words, dtype=object),
+                                           np.asarray(lemmas, dtype=object)])
+        positions = self.entries.get_indexer(query)
+        found = positions >= 0
+        feats = np.empty(len(positions), dtype=object)
+        feats[found] = self.get_entry_pos(positions[found]) if only_pos \
+            else self.entry_feats[positions[found]]
+        for missing in np.flatnonzero(~found):
+            feats[missing] = set()
+        return pd.Series(feats, index=words.index, dtype=object)
+
+    def pos_codes(self, features):
+        '''
+        Part of speech codes (see `pos_code`) of a Series of feature strings,
+        parsing each distinct feature string once.
+        '''
+        codes, uniques = pd.factorize(features)
+        # Missing features (code -1) take the last, other, code
+        unique_codes = np.array([pos_code(f) for f in uniques] +
+                                [len(pos_tags)], dtype=np.int8)
+        return unique_codes[codes]
+
+    def get_lexical_forms(self, lemmas, features, all_forms=False):
+        '''
+        Lexical form of each lemma with each feature: the word that MorphoBR
+        keeps last for them, or with `all_forms`, the list of every such word.
+        Lemmas without a lexical form for the feature are their own form.
+
+        Arguments:
+            lemmas: pandas.Series - Lemmas
+            features: pandas.Series - Feature string of each lemma
+            all_forms: bool - Return every matching form
+        Return:
+            pandas.Series - Lexical form (or forms) of each lemma
+        '''
+        lemmas = np.asarray(lemmas, dtype=object)
+        query = pd.MultiIndex.from_arrays([lemmas,
+                                           np.asarray(features, dtype=object)])
+        table = self.get_all_forms() if all_forms else self.forms
+        positions = table.index.get_indexer(query)
+        found = positions >= 0
+        forms = np.empty(len(positions), dtype=object)
+        forms[found] = table.to_numpy()[positions[found]]
+        # No lexical form found, use lemma
+        for missing in np.flatnonzero(~found):
+            forms[missing] = [lemmas[missing]] if all_forms \
+                else lemmas[missing]
+        return pd.Series(forms, dtype=object)
+
+    def memory_usage(self):
+        '''
+        Approximate number of bytes used by the morphological data.
+        '''
+        seen = set()
+        total = 0
+        stack = list(self.entry_feats)
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            total += sys.getsizeof(obj)
+            if isinstance(obj, set):
+                stack.extend(obj)
+        total += self.entries.memory_usage(deep=True) + \
+            self.entry_feats.nbytes + self.forms.memory_usage(deep=True)
+        return total
+
+
+class CompactMorphoBR(MorphoBR):
+    '''
+    MorphoBR with words, lemmas and feature tags interned to integer IDs.
+
+    (word, lemma) entries are kept sorted by their IDs, with the feature tags
+    of each entry in CSR form (`feat_offsets`, `feat_ids`). Lexical forms are
+    kept as a sorted array of (lemma, tag) keys and the matching word IDs,
+    words of the same key following the order of the entries. The arrays are
+    built straight from the lines of the MorphoBR files, whose strings are
+    interned as they are parsed, so no dict of the entries is ever built.
+    '''
+
+    def __init__(self, word_codes, words, lemma_codes, lemmas, tag_codes,
+                 tags):
+        '''
+        Arguments:
+            word_codes: numpy.ndarray - Word of each line, coded in `words`
+            words: pandas.Index - Sorted words
+            lemma_codes: numpy.ndarray - Lemma of each line, coded in `lemmas`
+            lemmas: pandas.Index - Sorted lemmas
+            tag_codes: numpy.ndarray - Features of each line, coded in `tags`
+            tags: pandas.Index - Sorted feature tags
+        '''
+        self.words, self.lemmas, self.tags = words, lemmas, tags
+        self.pos_tags = np.array([t.split('+')[0] for t in self.tags],
+                                 dtype=object)
+        n_lemmas, n_tags = max(len(lemmas), 1), max(len(tags), 1)
+
+        # (word, lemma) entries, each first read at line `first`
+        line_entries = word_codes.astype(np.int64) * n_lemmas + lemma_codes
+        self.entry_keys, first, line_entries = np.unique(
+            line_entries, return_index=True, return_inverse=True)
+
+        # Distinct (entry, tag) pairs, sorted by entry and tag
+        pairs, pair_lines = np.unique(line_entries * n_tags + tag_codes,
+                                      return_index=True)
+        pair_entries, pair_tags = pairs // n_tags, pairs % n_tags
+        self.feat_offsets = np.zeros(len(self.entry_keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_entries, minlength=len(self.entry_keys)),
+                  out=self.feat_offsets[1:])
+        self.feat_ids = pair_tags.astype(np.int32)
+
+        # (lemma, tag) -> words, in the order their entries were first read
+        form_keys = lemma_codes[pair_lines].astype(np.int64) * n_tags + \
+            pair_tags
+        order = np.lexsort((first[pair_entries], form_keys))
+        self.form_keys = form_keys[order]
+        self.form_words = word_codes[pair_lines][order].astype(np.int32)
+
+        self.vocab = self.words
+        logger.info('Compact MorphoBR uses '
+                    f'{self.memory_usage() / 2 ** 20:.1f} MiB')
+
+    @classmethod
+    def read(cls, dirpath, workers=1, words=None, lemmas=None):
+        '''
+        Reads MorphoBR as `MorphoBR.read` does, interning the words, lemmas
+        and features of each line as it is parsed.
+        '''
+        logger.info(f'Loading MorphoBR from directory {dirpath}')
+        filepaths = _list_files(dirpath)
+        ids = (dict(), dict(), dict())
+        codes = (array('i'), array('i'), array('i'))
+
+        def intern(lines):
+            for line in lines:
+                for value, value_ids, value_codes in zip(line, ids, codes):
+                    value_codes.append(value_ids.setdefault(value,
+                                                            len(value_ids)))
+
+        if workers > 1:
+            logger.info(f'Parsing {len(filepaths)} files with {workers} workers')
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=(words, lemmas)) as executor:
+                for lines in executor.map(_read_file_lines, filepaths):
+                    intern(lines)
+        else:
+            for filepath in filepaths:
+                intern(_parse_lines(filepath, words, lemmas))
+        logger.info(f'Loaded {len(codes[0])} lines')
+        (word_codes, words), (lemma_codes, lemmas), (tag_codes, tags) = \
+            [_sorted_codes(c, i) for c, i in zip(codes, ids)]
+        return cls(word_codes, words, lemma_codes, lemmas, tag_codes, tags)
+
+    @staticmethod
+    def _search(keys, codes1, codes2, n_codes2):
+        '''
+        Positions of the (codes1, codes2) pairs in the sorted `keys`,
+        or -1 for pairs that are not there.
+        '''
+        query = codes1.astype(np.int64) * n_codes2 + codes2
+        if len(keys) == 0:
+            return np.full(len(query), -1)
+        positions = np.searchsorted(keys, query)
+        positions[positions >= len(keys)] = 0
+        found = (codes1 >= 0) & (codes2 >= 0) & (keys[positions] == query)
+        return np.where(found, positions, -1)
+
+    def get_feats(self, words, lemmas, only_pos=False):
+        positions = self._search(self.entry_keys,
+                                 self.words.get_indexer(words),
+                                 self.lemmas.get_indexer(lemmas),
+                                 len(self.lemmas))
+        tags = self.pos_tags if only_pos else self.tags.to_numpy()
+        feats = [set(tags[self.feat_ids[self.feat_offsets[p]:
+                                        self.feat_offsets[p + 1]]])
+                 if p >= 0 else set()
+                 for p in positions]
+        return pd.Series(feats, index=words.index, dtype=object)
+
+    def get_lexical_forms(self, lemmas, features, all_forms=False):
+        lemma_codes = self.lemmas.get_indexer(lemmas)
+        tag_codes = self.tags.get_indexer(features)
+        query = lemma_codes.astype(np.int64) * len(self.tags) + tag_codes
+        starts = np.searchsorted(self.form_keys, query, side='left')
+        stops = np.searchsorted(self.form_keys, query, side='right')
+        found = (lemma_codes >= 0) & (tag_codes >= 0) & (stops > starts)
+        words = self.words.to_numpy()
+        lemmas = np.asarray(lemmas, dtype=object)
+        if all_forms:
+            forms = [list(words[self.form_words[start:stop]]) if f else [l]
+                     for start, stop, f, l in zip(starts, stops, found, lemmas)]
+            return pd.Series(forms, dtype=object)
+        # No lexical form found, use lemma. Otherwise, the last word of the
+        # key is the one MorphoBR keeps
+        forms = lemmas.copy()
+        forms[found] = words[self.form_words[stops[found] - 1]]
+        return pd.Series(forms, dtype=object)
+
+    def memory_usage(self):
+        '''
+        Number of bytes used by the morphological data.
+        '''
+        arrays = [self.entry_keys, self.feat_offsets, self.feat_ids,
+                  self.form_keys, self.form_words, self.pos_tags]
+        indices = [self.words, self.lemmas, self.tags]
+        return sum(a.nbytes for a in arrays) + \
+            sum(i.memory_usage(deep=True) for i in indices)
+
+
+def _list_files(dirpath):
+    '''
+    Files of the adjectives, adverbs, nouns and verbs folders of MorphoBR.
+    '''
+    folders = ['adjectives', 'adverbs',
+               'nouns', 'verbs']
+    return [filepath
+            for folder in dirpath.iterdir() if folder.name in folders
+            for filepath in folder.iterdir()]
+
+
+def _parse_lines(filepath, words=None, lemmas=None):
+    '''
+    Yields the (word, lemma, features) of each line of a MorphoBR file, only
+    of the `words` or `lemmas` if either is given.
+    '''
+    pruned = words is not None or lemmas is not None
+    words = words or frozenset()
+    lemmas = lemmas or frozenset()
+    with filepath.open('r', encoding='utf-8') as file_:
+        for line in file_:
+            word, features = line.rstrip().split('\t')
+            split_feats = features.split('+')
+            lemma = split_feats[0]
+            if pruned and word not in words and lemma not in lemmas:
+                continue
+            yield word, lemma, '+'.join(split_feats[1:])
+
+
+def _parse_file(filepath, morphology_dict, words=None, lemmas=None):
+    for word, lemma, feats in _parse_lines(filepath, words, lemmas):
+        if (word, lemma) not in morphology_dict:
+            morphology_dict[(word, lemma)] = set()
+        morphology_dict[(word, lemma)].add(feats)
+    return morphology_dict
+
+
+def _sorted_codes(codes, ids):
+    '''
+    Codes in the dictionary `ids` recoded to the sorted index of its keys.
+
+    Return:
+        (numpy.ndarray, pandas.Index) - Codes and the sorted index
+    '''
+    values = np.array(list(ids), dtype=object)
+    order = np.argsort(values, kind='stable')
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    codes = np.frombuffer(codes, dtype=np.int32) if len(codes) \
+        else np.array([], dtype=np.int32)
+    return rank[codes], pd.Index(values[order], dtype=object)
+
+
+_worker_words = None
+_worker_lemmas = None
+
+
+def _init_worker(words, lemmas):
+    global _worker_words, _worker_lemmas
+    _worker_words, _worker_lemmas = words, lemmas
+
+
+def _read_file(filepath):
+    return _parse_file(filepath, dict(), _worker_words, _worker_lemmas)
+
+
+def _read_file_lines(filepath):
+    return list(_parse_lines(filepath, _worker_words, _worker_lemmas))
 
 
 if __name__ == '__main__':
@@ -86,6 +419,10 @@ if __name__ == '__main__':
     lemmas = pd.Series(['mal', 'despir', 'rever', 'kjfj'])
     feats = morphobr.get_feats(words, lemmas)
     print(feats)
-    antonyms = pd.Series([['bem'], ['vestir'], ['esquecer'], ['kjfj']])
-    lex_form = morphobr.get_lexical_forms(antonyms, feats)
+    antonyms = pd.Series(['bem', 'vestir', 'esquecer', 'kjfj'])
+    features = feats.explode()
+    lex_form = morphobr.get_lexical_forms(antonyms.loc[features.index],
+                                          features)
     print(lex_form)
+    print(morphobr.get_lexical_forms(antonyms.loc[features.index], features,
+                                     all_forms=True))
@@ -1,13 +1,22 @@
 from pathlib import Path
+from typing import Union
 
+import numpy as np
 import pandas as pd
-from pyphen import Pyphen
 
 from .read_kb_triples import LexicalBase
 from .read_morphobr import MorphoBR
+from .syllables import agglutination_in_syllable
 
 
-def read_seco(filepath: Path, lexical_base: Path = None, morphological_base: Path = None) -> pd.DataFrame:
+def read_seco(filepath: Path,
+              lexical_base: Union[Path, LexicalBase] = None,
+              morphological_base: Union[Path, MorphoBR] = None) -> pd.DataFrame:
+    '''
+    Reads the antonym riddles of SECO. With a lexical and a morphological
+    base, either already loaded or paths to read them from, the parts of the
+    riddles are retrieved and annotated.
+    '''
     df = pd.read_csv(filepath, encoding='utf-8')
 
     # Get only antonym riddles
@@ -18,48 +27,70 @@ def read_seco(filepath: Path, lexical_base: Path = None, morphological_base: Pat
 
     # Retrieve riddles parts
     if lexical_base is not None and morphological_base is not None:
+        lexbase = lexical_base
+        if not isinstance(lexbase, LexicalBase):
+            lexbase = LexicalBase.read(lexical_base)
+        morphbase = morphological_base
+        if not isinstance(morphbase, MorphoBR):
+            morphbase = MorphoBR.read(morphological_base)
+
         df['#Termo'] = df['adivinha'].str.extract(r'(\w+)\?')
-        lexbase = LexicalBase.read(lexical_base)
-        df['P1'] = df['relacionado_1'].apply(lexbase.antonyms_of)
-        df['P2'] = df['relacionado_2'].apply(lexbase.antonyms_of)
-        df = df.explode('P1')
-        df = df.explode('P2')
-        df = df.loc[[x[0] in x[1] for x in zip(df['P1'], df['#Termo'])], :]
-        df = df.loc[[x[0] in x[1] for x in zip(df['P2'], df['#Termo'])], :]
+        df.reset_index(inplace=True)
+        df = join_antonyms(df, lexbase.antonymy_edges,
+                           'relacionado_1', 'P1', 'Relation 1 Weight')
+        df = join_antonyms(df, lexbase.antonymy_edges,
+                           'relacionado_2', 'P2', 'Relation 2 Weight')
 
         # Remove duplicates (keep larger part)
-        df.reset_index(inplace=True)
-        df.sort_values(by='P1', inplace=True,
+        df.sort_values(by='P1', inplace=True, kind='stable',
                        key=lambda x: x.str.len())
         df.drop_duplicates('index', keep='last', inplace=True)
         df.sort_values(by='index', inplace=True)
         df.set_index('index', inplace=True)
+        weight_1 = df.pop('Relation 1 Weight')
+        weight_2 = df.pop('Relation 2 Weight')
 
         # Find if agglutination coincides with a syllable
-        dic = Pyphen(lang='pt_PT')
-        # triples (P1, P2, Syllables)
-        syl_agglu_pos = zip(df['P1'].str.len(),
-                            df['#Termo'].str.len() - df['P2'].str.len(),
-                            df['#Termo'].apply(dic.positions))
-        df['Agglutination in syllable'] = [agglu_p1 in syl_pos or agglu_p2 in syl_pos
-                                           for agglu_p1, agglu_p2, syl_pos in syl_agglu_pos]
+        df['Agglutination in syllable'] = agglutination_in_syllable(
+            df['#Termo'], df['P1'], df['P2'])
 
         # Morphological analysis
-        morphbase = MorphoBR.read(morphological_base)
-        p1_feats = morphbase.get_feats(df['P1'],
-                                       df['P1'],
-                                       only_pos=True)
-        p2_feats = morphbase.get_feats(df['P2'],
-                                       df['P2'],
-                                       only_pos=True)
-        df['P1 Features'] = p1_feats
-        df['P2 Features'] = p2_feats
-        df = df.explode('P1 Features')
-        df = df.explode('P2 Features')
+        df['P1 Features'] = morphbase.get_feats(df['P1'],
+                                                df['P1'],
+                                                only_pos=True)
+        df['P2 Features'] = morphbase.get_feats(df['P2'],
+                                                df['P2'],
+                                                only_pos=True)
 
         # Add relation weights
-        df['Relation 1 Weight'] = df.aggregate(lambda x: lexbase.get_weight(x['P1'], x['relacionado_1']),
-                                               axis='columns')
-        df['Relation 2 Weight'] = df.aggregate(lambda x: lexbase.get_weight(x['P2'], x['relacionado_2']),
-                                               axis='columns')
+        df['Relation 1 Weight'] = weight_1
+        df['Relation 2 Weight'] = weight_2
+        df = df.explode('P1 Features')
+        df = df.explode('P2 Features')
     return df
+
+
+def join_antonyms(df: pd.DataFrame, edges: pd.DataFrame, related: str,
+                  part: str, weight: str) -> pd.DataFrame:
+    '''
+    Joins each riddle with the antonyms of its `related` word, keeping those
+    contained in the term as riddle `part`, with their relation `weight`.
+
+    Arguments:
+        df: pandas.DataFrame - Riddles, with the term in column '#Termo'
+        edges: pandas.DataFrame - Antonymy edges (Word, Antonym, Weight)
+        related: str - Column of the words related to the parts
+        part: str - Column to store the parts
+        weight: str - Column to store the weight of the relations
+    Return:
+        pandas.DataFrame - One row per riddle and part found in its term
+    '''
+    edges = edges.rename(columns={'Word': related,
+                                  'Antonym': part,
+                                  'Weight': weight})
+    df = df.merge(edges, on=related, how='inner')
+    # Riddles whose term could not be extracted have no parts
+    in_term = np.fromiter((isinstance(term, str) and antonym in term
+                           for term, antonym in zip(df['#Termo'], df[part])),
+                          dtype=bool, count=len(df))
+    return df.loc[in_term].reset_index(drop=True)
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+
+from seco.profiling import stage
+
+logger = logging.getLogger('riddles')
+# Reader options that do not change the parsed result
+UNKEYED_OPTIONS = {'workers', 'syllable_cache'}
+
+
+def fingerprint(path: Path) -> list:
+    '''
+    Describes the current state of `path` through the size and modification
+    time of the file (or of every file under it, for directories).
+    '''
+    path = Path(path)
+    files = sorted(p for p in path.rglob('*') if p.is_file()) \
+        if path.is_dir() else [path]
+    state = list()
+    for file_ in files:
+        stat = file_.stat()
+        state.append([str(file_.relative_to(path)) if path.is_dir() else '',
+                      stat.st_size, stat.st_mtime_ns])
+    return state
+
+
+def snapshot_path(reader, path: Path, cache_dir: Path, **kwargs) -> Path:
+    '''
+    Path of the snapshot of `reader` for the source `path` read with `kwargs`.
+    '''
+    options = {k: _option_key(v) for k, v in kwargs.items()
+               if k not in UNKEYED_OPTIONS}
+    key = json.dumps([str(Path(path).resolve()), options],
+                     sort_keys=True, default=str)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return Path(cache_dir) / f'{reader.__name__}-{digest}.pkl'
+
+
+def _option_key(value):
+    '''
+    Stable key of a reader option, summarising sets (such as the vocabulary
+    of a pruned read) by their size and a digest of their sorted items.
+    '''
+    if isinstance(value, (set, frozenset)):
+        items = '\n'.join(sorted(str(v) for v in value))
+        digest = hashlib.sha1(items.encode('utf-8')).hexdigest()
+        return f'set of {len(value)}: {digest}'
+    return value
+
+
+def read_cached(reader, path: Path, cache_dir: Path = None, **kwargs):
+    '''
+    Reads `path` through `reader.read`, keeping a binary snapshot of the parsed
+    reader in `cache_dir`. The snapshot is reused while the source size,
+    modification time and `reader.version` are unchanged; otherwise the source
+    is parsed again and the snapshot rewritten. Without `cache_dir`, this is
+    the same as calling `reader.read`.
+
+    Arguments:
+        reader: class - Reader class with a `read` classmethod
+        path: pathlib.Path - Source file or directory
+        cache_dir: pathlib.Path - Directory where snapshots are kept
+        kwargs: Extra arguments to `reader.read`
+    Return:
+        An instance of `reader`
+    '''
+    with stage(f'{reader.__name__}.read', source=str(path)) as record:
+        instance, record['snapshot'] = _read_cached(reader, path, cache_dir,
+                                                    **kwargs)
+        data = getattr(instance, 'data', None)
+        if data is not None:
+            record['rows_out'] = data.shape[0]
+    return instance
+
+
+def _read_cached(reader, path, cache_dir, **kwargs):
+    '''
+    Reads an instance of `reader` as `read_cached`, also returning whether
+    the snapshot was used ('hit'), rewritten ('miss') or not enabled (None).
+    '''
+    if cache_dir is None:
+        return reader.read(path, **kwargs), None
+
+    header = {'reader': reader.__name__,
+              'version': getattr(reader, 'version', 0),
+              'source': fingerprint(path)}
+    filepath = snapshot_path(reader, path, cache_dir, **kwargs)
+    if filepath.exists():
+        try:
+            with filepath.open('rb') as file_:
+                if pickle.load(file_) == header:
+                    logger.info(f'Loading snapshot \'{filepath}\'')
+                    return pickle.load(file_), 'hit'
+            logger.info(f'Snapshot \'{filepath}\' is stale')
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            logger.warning(f'Ignoring snapshot \'{filepath}\': {error}')
+
+    instance = reader.read(path, **kwargs)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_filepath = filepath.with_suffix(f'.{os.getpid()}.tmp')
+    with tmp_filepath.open('wb') as file_:
+        pickle.dump(header, file_, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(instance, file_, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filepath, filepath)
+    logger.info(f'Saved snapshot \'{filepath}\'')
+    return instance, 'miss'
@@ -0,0 +1,473 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .read_agglutlex import AgglutLex
+from .read_kb_triples import LexicalBase
+from .read_morphobr import MorphoBR
+
+logger = logging.getLogger('riddles')
+# Joins the parts of the composite keys of MorphoBR entries and forms, which
+# never contain it, since MorphoBR files are tab separated
+key_separator = '\t'
+schema = '''
+CREATE TABLE metadata (name TEXT PRIMARY KEY, value) WITHOUT ROWID;
+CREATE TABLE antonymy (word TEXT, antonym TEXT, weight INTEGER,
+                       PRIMARY KEY (word, antonym)) WITHOUT ROWID;
+CREATE TABLE antonymy_words (word TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE entries (key TEXT, rank INTEGER, feature TEXT,
+                      PRIMARY KEY (key, rank)) WITHOUT ROWID;
+CREATE TABLE vocabulary (word TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE forms (key TEXT, rank INTEGER, word TEXT,
+                    PRIMARY KEY (key, rank)) WITHOUT ROWID;
+CREATE TABLE frequencies (word TEXT PRIMARY KEY,
+                          frequency INTEGER) WITHOUT ROWID;
+'''
+
+
+class ResourceStore(object):
+    '''
+    SQLite database with the SECO resources, to generate riddles without
+    keeping the Lexical Base, MorphoBR and the Frequency Lexicon in memory.
+
+    Every table is keyed by the words it is queried by, and the readers
+    backed by the store (`StoreLexicalBase`, `StoreMorphoBR` and
+    `StoreFrequencyLexicon`) look up batches of distinct keys with one
+    indexed query per `batch_size` keys, keeping the last `cache_size`
+    answers of each kind in an LRU cache. Each thread and forked process
+    opens its own read-only connection.
+    '''
+    # Bump when the schema changes, to reject stores built by other versions
+    version = 1
+
+    def __init__(self, filepath: Path, cache_size: int = 2 ** 16,
+                 batch_size: int = 500) -> None:
+        self.filepath = Path(filepath)
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.local = threading.local()
+        if not self.filepath.exists():
+            raise FileNotFoundError(f'No resource store at \'{filepath}\'')
+        version = self.metadata('version')
+        if version != self.version:
+            raise ValueError(f'Resource store \'{filepath}\' is from version '
+                             f'{version}, expected {self.version}')
+
+    @classmethod
+    def build(cls, filepath: Path, agglutlex: AgglutLex,
+              frequencies: pd.Series, lexbase: LexicalBase,
+              morphobr: MorphoBR) -> 'ResourceStore':
+        '''
+        Writes the resources to a new store at `filepath`, replacing it once
+        complete. The Frequency Lexicon is given as parsed by
+        `FrequencyLexicon.parse`, since the lexicon itself only keeps hashes
+        of the words. MorphoBR must be loaded with `MorphoBR`, not
+        `CompactMorphoBR`.
+
+        Return:
+            ResourceStore - The store built
+        '''
+        filepath = Path(filepath)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_filepath = filepath.with_suffix(f'.{os.getpid()}.tmp')
+        if tmp_filepath.exists():
+            tmp_filepath.unlink()
+        logger.info(f'Building resource store \'{filepath}\'')
+        start = time.perf_counter()
+        connection = sqlite3.connect(tmp_filepath)
+        try:
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.executescript(schema)
+            with connection:
+                _insert_agglutlex(connection, agglutlex)
+                _insert_lexbase(connection, lexbase)
+                _insert_morphobr(connection, morphobr)
+                _insert_frequencies(connection, frequencies)
+                connection.executemany(
+                    'INSERT INTO metadata VALUES (?, ?)',
+                    [('version', cls.version)])
+            connection.execute('ANALYZE')
+        finally:
+            connection.close()
+        os.replace(tmp_filepath, filepath)
+        elapsed = time.perf_counter() - start
+        logger.info(f'Resource store built in {elapsed:.1f}s '
+                    f'({filepath.stat().st_size / 2 ** 20:.1f} MiB)')
+        return cls(filepath)
+
+    def connection(self) -> sqlite3.Connection:
+        '''
+        Read-only connection of the current thread, opened again in forked
+        processes.
+        '''
+        local = self.local
+        if getattr(local, 'pid', None) != os.getpid():
+            uri = f'{self.filepath.resolve().as_uri()}?mode=ro'
+            local.connection = sqlite3.connect(uri, uri=True)
+            local.pid = os.getpid()
+        return local.connection
+
+    def metadata(self, name: str):
+        row = self.connection().execute(
+            'SELECT value FROM metadata WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def select(self, sql: str, keys: list) -> list:
+        '''
+        Rows of the query `sql` for every key of `keys`, run once per batch
+        of `batch_size` keys, which replace the `{keys}` placeholder of
+        `sql` (as in 'SELECT ... WHERE word IN ({keys})').
+        '''
+        connection = self.connection()
+        rows = list()
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start + self.batch_size]
+            rows.extend(connection.execute(
+                sql.format(keys=', '.join('?' * len(batch))), batch))
+        return rows
+
+    def agglutlex(self) -> AgglutLex:
+        '''
+        Agglutination Lexicon, which drives the generation, loaded into
+        memory.
+        '''
+        data = pd.read_sql_query('SELECT * FROM agglutinations ORDER BY rowid',
+                                 self.connection())
+        data = data.fillna(np.nan)
+        data['Agglutination in syllable'] = \
+            data['Agglutination in syllable'].astype(bool)
+        logger.info(f'{data.shape[0]} agglutinations loaded from '
+                    f'\'{self.filepath}\'')
+        return AgglutLex(data)
+
+
+class LRUCache(object):
+    '''
+    Mapping keeping the last `max_size` keys used.
+    '''
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys, fetch) -> list:
+        '''
+        Values of the distinct `keys`. Keys not in the cache are fetched in
+        a single call to `fetch`, which takes a list of keys and returns a
+        dict with the value of each of them.
+        '''
+        found, missing = dict(), list()
+        with self.lock:
+            for key in keys:
+                if key in self.items:
+                    self.items.move_to_end(key)
+                    found[key] = self.items[key]
+                else:
+                    missing.append(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            fetched = fetch(missing)
+            found.update(fetched)
+            with self.lock:
+                for key in missing[-self.max_size:]:
+                    self.items[key] = fetched[key]
+                while len(self.items) > self.max_size:
+                    self.items.popitem(last=False)
+        return [found[key] for key in keys]
+
+
+class StoreSet(object):
+    '''
+    Set of words in a one-column `table` of a store, such as MorphoBR's
+    vocabulary. Besides `in`, batches of words are looked up with
+    `contains_many`.
+    '''
+
+    def __init__(self, store: ResourceStore, table: str) -> None:
+        self.store = store
+        self.table = table
+        self.cache = LRUCache(store.cache_size)
+        self.size = None
+
+    def __len__(self) -> int:
+        if self.size is None:
+            self.size = self.store.connection().execute(
+                f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        return self.size
+
+    def __contains__(self, word) -> bool:
+        return bool(self.contains_many([word])[0])
+
+    def contains_many(self, words) -> np.ndarray:
+        '''
+        Whether each of the `words` is in the set.
+        '''
+        codes, uniques = pd.factorize(np.asarray(words, dtype=object))
+        found = np.zeros(len(uniques) + 1, dtype=bool)
+        found[:-1] = self.cache.get_many(list(uniques), self.fetch)
+        # Missing words (code -1) take the last, False, value
+        return found[codes]
+
+    def fetch(self, words: list) -> dict:
+        keys = [w for w in words if isinstance(w, str)]
+        rows = self.store.select(f'SELECT word FROM {self.table} '
+                                 'WHERE word IN ({keys})', keys)
+        found = {word for word, in rows}
+        return {w: w in found for w in words}
+
+
+class StoreLexicalBase(LexicalBase):
+    '''
+    Antonymy relations of the Lexical Base, looked up in a `ResourceStore`.
+    Other relations are not kept in the store, so `data` is not available.
+    '''
+
+    def __init__(self, store: ResourceStore) -> None:
+        self.store = store
+        self.data = None
+        self.antonymy_words = StoreSet(store, 'antonymy_words')
+        self.cache = LRUCache(store.cache_size)
+        self.edges = None
+
+    @property
+    def antonymy_edges(self) -> pd.DataFrame:
+        '''
+        Table of every antonymy relation (see `LexicalBase`), loaded into
+        memory on the first access.
+        '''
+        if self.edges is None:
+            self.edges = pd.read_sql_query(
+                'SELECT word AS Word, antonym AS Antonym, weight AS Weight '
+                'FROM antonymy ORDER BY word, antonym',
+                self.store.connection())
+        return self.edges
+
+    def fetch(self, words: list) -> dict:
+        keys = [w for w in words if isinstance(w, str)]
+        antonymy = {w: dict() for w in words}
+        for word, antonym, weight in self.store.select(
+                'SELECT word, antonym, weight FROM antonymy '
+                'WHERE word IN ({keys}) ORDER BY word, antonym', keys):
+            antonymy[word][antonym] = weight
+        return antonymy
+
+    def antonyms_dicts(self, words) -> list:
+        '''
+        Antonyms of each of the `words` with their weights
+        ({antonym: weight}).
+        '''
+        codes, uniques = pd.factorize(np.asarray(words, dtype=object))
+        antonymy = self.cache.get_many(list(uniques), self.fetch) + [dict()]
+        return [antonymy[c] for c in codes]
+
+    def antonyms_of(self, word: str) -> set:
+        return set(self.antonyms_dicts([word])[0])
+
+    def antonyms_of_many(self, words: pd.Series) -> pd.Series:
+        return pd.Series([set(a) for a in self.antonyms_dicts(words)],
+                         index=words.index, dtype=object)
+
+    def get_weight(self, word1: str, word2: str) -> int:
+        return self.antonyms_dicts([word1])[0].get(word2, 0)
+
+    def weights_of_pairs(self, words1: pd.Series,
+                         words2: pd.Series) -> pd.Series:
+        weights = [antonymy.get(w2, 0) for antonymy, w2
+                   in zip(self.antonyms_dicts(words1), words2)]
+        return pd.Series(weights, index=words1.index, dtype='int64')
+
+
+class StoreMorphoBR(MorphoBR):
+    '''
+    MorphoBR entries and lexical forms, looked up in a `ResourceStore`.
+    '''
+
+    def __init__(self, store: ResourceStore) -> None:
+        self.store = store
+        self.vocab = StoreSet(store, 'vocabulary')
+        self.feats_cache = LRUCache(store.cache_size)
+        self.forms_cache = LRUCache(store.cache_size)
+
+    def fetch_feats(self, keys: list) -> dict:
+        feats = {k: list() for k in keys}
+        for key, feature in self.store.select(
+                'SELECT key, feature FROM entries '
+                'WHERE key IN ({keys}) ORDER BY key, rank', keys):
+            feats[key].append(feature)
+        return {k: set(f) for k, f in feats.items()}
+
+    def fetch_forms(self, keys: list) -> dict:
+        forms = {k: list() for k in keys}
+        for key, word in self.store.select(
+                'SELECT key, word FROM forms '
+                'WHERE key IN ({keys}) ORDER BY key, rank', keys):
+            forms[key].append(word)
+        return forms
+
+    def lookup(self, cache: LRUCache, fetch, values1, values2) -> tuple:
+        '''
+        Values of the (values1, values2) keys in the store, fetched once per
+        distinct key.
+
+        Return:
+            (numpy.ndarray, list) - Code of each key, -1 for keys with a
+                missing part, and the value of each code
+        '''
+        keys = [f'{v1}{key_separator}{v2}'
+                if isinstance(v1, str) and isinstance(v2, str) else None
+                for v1, v2 in zip(values1, values2)]
+        codes, uniques = pd.factorize(np.asarray(keys, dtype=object))
+        return codes, cache.get_many(list(uniques), fetch)
+
+    def get_feats(self, words, lemmas, only_pos=False):
+        codes, feats = self.lookup(self.feats_cache, self.fetch_feats,
+                                   words, lemmas)
+        if only_pos:
+            feats = [{f.split('+')[0] for f in fs} for fs in feats]
+        return pd.Series([feats[c] if c >= 0 else set() for c in codes],
+                         index=words.index, dtype=object)
+
+    def get_lexical_forms(self, lemmas, features, all_forms=False):
+        lemmas = np.asarray(lemmas, dtype=object)
+        codes, forms = self.lookup(self.forms_cache, self.fetch_forms,
+                                   lemmas, features)
+        result = np.empty(len(lemmas), dtype=object)
+        for i, (code, lemma) in enumerate(zip(codes, lemmas)):
+            words = forms[code] if code >= 0 else None
+            # No lexical form found, use lemma. Otherwise, the last word of
+            # the key is the one MorphoBR keeps
+            if not words:
+                result[i] = [lemma] if all_forms else lemma
+            else:
+                result[i] = list(words) if all_forms else words[-1]
+        return pd.Series(result, dtype=object)
+
+    def memory_usage(self):
+        '''
+        Approximate number of bytes used by the cached entries and forms.
+        '''
+        return sum(sys.getsizeof(k) + sys.getsizeof(v)
+                   for cache in [self.feats_cache, self.forms_cache]
+                   for k, v in cache.items.items())
+
+
+class StoreFrequencyLexicon(object):
+    '''
+    Word frequencies looked up in a `ResourceStore`, answering `lookup` and
+    `get_frequencies` as `FrequencyLexicon` does. Frequencies are not kept
+    in arrays, so there are no `positions`, nor arrays to `save`.
+    '''
+
+    def __init__(self, store: ResourceStore) -> None:
+        self.store = store
+        self.cache = LRUCache(store.cache_size)
+
+    def fetch(self, words: list) -> dict:
+        keys = [w for w in words if isinstance(w, str)]
+        freqs = dict.fromkeys(words)
+        freqs.update(self.store.select(
+            'SELECT word, frequency FROM frequencies WHERE word IN ({keys})',
+            keys))
+        return freqs
+
+    def frequencies(self, words) -> np.ndarray:
+        '''
+        Frequency of each of the `words`, -1 for words not in the corpus.
+        '''
+        codes, uniques = pd.factorize(np.asarray(words, dtype=object))
+        freqs = np.full(len(uniques) + 1, -1, dtype=np.int64)
+        found = self.cache.get_many(list(uniques), self.fetch)
+        freqs[:-1] = [-1 if f is None else f for f in found]
+        return freqs[codes]
+
+    def lookup(self, words, smoothing=False):
+        freqs = np.maximum(self.frequencies(words), 0)
+        if smoothing:
+            freqs += 1
+        return freqs
+
+    def get_frequencies(self, words, smoothing=False):
+        words = words.drop_duplicates()
+        freqs = self.frequencies(words)
+        found = freqs >= 0
+        freqs = np.maximum(freqs, 0) + 1 if smoothing else freqs
+        freqs = pd.Series(freqs, index=words.to_numpy())
+        if not smoothing:
+            freqs = freqs.loc[found]
+        return freqs
+
+
+def _insert_agglutlex(connection, agglutlex):
+    agglutlex.data.to_sql('agglutinations', connection, index=False)
+    logger.info(f'{agglutlex.data.shape[0]} agglutinations stored')
+
+
+def _insert_lexbase(connection, lexbase):
+    edges = lexbase.antonymy_edges
+    connection.executemany(
+        'INSERT INTO antonymy VALUES (?, ?, ?)',
+        zip(edges['Word'], edges['Antonym'], edges['Weight'].tolist()))
+    connection.executemany(
+        'INSERT INTO antonymy_words VALUES (?)',
+        ((w,) for w in sorted(lexbase.words_with_antonymy())))
+    logger.info(f'{edges.shape[0]} antonymy relations stored')
+
+
+def _insert_morphobr(connection, morphobr):
+    if not hasattr(morphobr, 'entry_feats'):
+        raise TypeError('Resource stores are built from MorphoBR, not '
+                        f'{type(morphobr).__name__}')
+    # Features keep the iteration order of their sets, and forms the order
+    # of the entries, so that the store answers as MorphoBR does
+    connection.executemany(
+        'INSERT INTO entries VALUES (?, ?, ?)',
+        ((f'{word}{key_separator}{lemma}', rank, feature)
+         for (word, lemma), feats in zip(morphobr.entries,
+                                         morphobr.entry_feats)
+         for rank, feature in enumerate(feats)))
+    connection.executemany('INSERT INTO vocabulary VALUES (?)',
+                           ((w,) for w in sorted(morphobr.vocab)))
+    forms = morphobr.form_table()
+    connection.executemany(
+        'INSERT INTO forms VALUES (?, ?, ?)',
+        zip((f'{lemma}{key_separator}{feature}'
+             for lemma, feature in zip(forms['Lemma'], forms['Features'])),
+            range(forms.shape[0]), forms['Word']))
+    logger.info(f'{len(morphobr.entries)} MorphoBR entries and '
+                f'{forms.shape[0]} lexical forms stored')
+
+
+def _insert_frequencies(connection, frequencies):
+    # Counts of repeated words are added up, and words read as missing
+    # values are left out, as they can never be looked up
+    counts = frequencies.groupby(level=0).sum()
+    counts = counts.loc[[isinstance(w, str) for w in counts.index]]
+    connection.executemany('INSERT INTO frequencies VALUES (?, ?)',
+                           zip(counts.index, counts.tolist()))
+    logger.info(f'{counts.shape[0]} word frequencies stored')
+
+
+if __name__ == '__main__':
+    store = ResourceStore(Path(sys.argv[1]))
+    lexbase = StoreLexicalBase(store)
+    print(lexbase.antonyms_of('rever'))
+    print(lexbase.get_weight('são', 'insano'))
+    morphobr = StoreMorphoBR(store)
+    words = pd.Series(['mal', 'despe', 'revi', 'kjfj'])
+    lemmas = pd.Series(['mal', 'despir', 'rever', 'kjfj'])
+    print(morphobr.get_feats(words, lemmas))
+    freqlex = StoreFrequencyLexicon(store)
+    print(freqlex.get_frequencies(words))
@@ -0,0 +1,126 @@
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyphen
+
+logger = logging.getLogger('riddles')
+
+
+class Syllabifier(object):
+    '''
+    Hyphenation positions of words, memoised in an LRU cache of `max_size`
+    words (unbounded by default). With `cache_path`, the memo is loaded from
+    that file when it exists and written back by `save`, so that it is reused
+    across runs.
+    '''
+
+    def __init__(self, lang: str = 'pt_PT', max_size: int = None,
+                 cache_path: Path = None) -> None:
+        self.lang = lang
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.dic = pyphen.Pyphen(lang=lang)
+        self.memo = OrderedDict()
+        if cache_path is not None and Path(cache_path).exists():
+            with Path(cache_path).open('rb') as file_:
+                lang_, memo = pickle.load(file_)
+            if lang_ == lang:
+                self.memo.update(memo)
+                logger.info(f'Loaded {len(self.memo)} syllabified words '
+                            f'from \'{cache_path}\'')
+
+    def remember(self, word: str, positions: tuple) -> None:
+        self.memo[word] = positions
+        if self.max_size is not None and len(self.memo) > self.max_size:
+            self.memo.popitem(last=False)
+
+    def positions(self, word: str) -> tuple:
+        if word in self.memo:
+            self.memo.move_to_end(word)
+            return self.memo[word]
+        positions = tuple(self.dic.positions(word))
+        self.remember(word, positions)
+        return positions
+
+    def positions_many(self, words: pd.Series, workers: int = 1,
+                       chunk_size: int = 10000) -> pd.Series:
+        '''
+        Hyphenation positions of every word in `words`, aligned with it. Each
+        distinct word is syllabified once, and words not yet memoised are
+        split in chunks of `chunk_size` among `workers` processes.
+        '''
+        unique_words = pd.unique(words)
+        missing = [w for w in unique_words if w not in self.memo]
+        if workers > 1 and len(missing) > chunk_size:
+            logger.info(f'Syllabifying {len(missing)} words '
+                        f'with {workers} workers')
+            chunks = [missing[start:start + chunk_size]
+                      for start in range(0, len(missing), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=(self.lang,)) as executor:
+                for chunk, positions in zip(chunks,
+                                            executor.map(_syllabify, chunks)):
+                    for word, word_positions in zip(chunk, positions):
+                        self.remember(word, word_positions)
+        positions = {w: self.positions(w) for w in unique_words}
+        return pd.Series([positions[w] for w in words],
+                         index=words.index, dtype=object)
+
+    def save(self) -> None:
+        if self.cache_path is None:
+            return
+        cache_path = Path(self.cache_path)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as file_:
+            pickle.dump((self.lang, dict(self.memo)), file_,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+
+_worker_dic = None
+
+
+def _init_worker(lang):
+    global _worker_dic
+    _worker_dic = pyphen.Pyphen(lang=lang)
+
+
+def _syllabify(words):
+    return [tuple(_worker_dic.positions(w)) for w in words]
+
+
+def agglutination_in_syllable(terms: pd.Series, p1: pd.Series, p2: pd.Series,
+                              syllabifier: Syllabifier = None,
+                              workers: int = 1) -> pd.Series:
+    '''
+    Checks whether the boundary of each agglutination, either the end of P1 or
+    the start of P2 in the term, coincides with a syllable boundary.
+
+    Arguments:
+        terms: pandas.Series - Whole agglutinated words
+        p1: pandas.Series - First subwords
+        p2: pandas.Series - Second subwords
+        syllabifier: Syllabifier - Syllabifier to use (a new one by default)
+        workers: int - Processes used to syllabify the terms
+    Return:
+        pandas.Series - Boolean check for each term, aligned with `terms`
+    '''
+    if syllabifier is None:
+        syllabifier = Syllabifier()
+    positions = syllabifier.positions_many(terms, workers=workers)
+    positions = positions.reset_index(drop=True).explode()
+    rows = positions.index.to_numpy()
+    agglu_p1 = p1.str.len().to_numpy()[rows]
+    agglu_p2 = (terms.str.len() - p2.str.len()).to_numpy()[rows]
+    positions = positions.to_numpy()
+    in_syllable = (positions == agglu_p1) | (positions == agglu_p2)
+    in_syllable = np.bincount(rows[in_syllable], minlength=len(terms)) > 0
+    return pd.Series(in_syllable, index=terms.index)
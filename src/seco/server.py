@@ -0,0 +1,203 @@
+import json
+import logging
+import socketserver
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from threading import Lock
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+logger = logging.getLogger('riddles')
+# Unix domain sockets are not available on every platform (e.g. Windows)
+unix_sockets = hasattr(socketserver, 'UnixStreamServer')
+
+
+class RiddleService(object):
+    '''
+    Answers riddle queries from the scored pool of a generator whose
+    resources are already loaded. Deterministic answers are kept in an LRU
+    cache of `cache_size` entries, and the latency of every query is recorded.
+    '''
+
+    endpoints = ['riddles', 'top', 'random', 'metrics']
+
+    def __init__(self, generator, cache_size: int = 1024,
+                 latency_window: int = 1000) -> None:
+        self.generator = generator
+        logger.info('Generating riddle pool')
+        self.pool = generator.get_pool()
+        logger.info(f'{self.pool.data.shape[0]} riddles in pool')
+        self.cached_answer = lru_cache(maxsize=cache_size)(self.answer)
+        self.latencies = defaultdict(lambda: deque(maxlen=latency_window))
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.lock = Lock()
+
+    def answer(self, endpoint: str, term: str = None, k: int = None,
+               seed: int = None) -> str:
+        '''
+        JSON records answering a query to `endpoint`.
+        '''
+        if endpoint == 'riddles':
+            if term is None:
+                raise ValueError('Missing \'term\' parameter')
+            riddles = self.pool.for_term(term, k)
+        elif endpoint == 'top':
+            riddles = self.pool.top(1 if k is None else k)
+        elif endpoint == 'random':
+            riddles = self.pool.sample(1 if k is None else k, seed)
+        else:
+            raise KeyError(endpoint)
+        return riddles.to_json(orient='records', force_ascii=False)
+
+    def query(self, endpoint: str, params: dict) -> str:
+        '''
+        Answers a query with the parameters of a request, going through the
+        cache unless the answer is random.
+        '''
+        if endpoint == 'metrics':
+            return json.dumps(self.metrics())
+        term = params.get('term')
+        k = int(params['k']) if 'k' in params else None
+        seed = int(params['seed']) if 'seed' in params else None
+        if endpoint == 'random' and seed is None:
+            return self.answer(endpoint, term, k, seed)
+        return self.cached_answer(endpoint, term, k, seed)
+
+    def record(self, endpoint: str, latency: float, error: bool) -> None:
+        with self.lock:
+            self.requests[endpoint] += 1
+            self.latencies[endpoint].append(latency)
+            if error:
+                self.errors[endpoint] += 1
+
+    def metrics(self) -> dict:
+        cache_info = self.cached_answer.cache_info()
+        metrics = {'pool_size': int(self.pool.data.shape[0]),
+                   'cache': {'hits': cache_info.hits,
+                             'misses': cache_info.misses,
+                             'size': cache_info.currsize,
+                             'max_size': cache_info.maxsize},
+                   'endpoints': dict()}
+        with self.lock:
+            for endpoint, count in self.requests.items():
+                latencies = np.array(self.latencies[endpoint]) * 1000
+                metrics['endpoints'][endpoint] = {
+                    'requests': count,
+                    'errors': self.errors[endpoint],
+                    'latency_ms': {
+                        'mean': float(latencies.mean()),
+                        'p50': float(np.percentile(latencies, 50)),
+                        'p95': float(np.percentile(latencies, 95)),
+                        'max': float(latencies.max())}}
+        return metrics
+
+
+class RiddleRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Maps `GET /<endpoint>?<params>` requests to the server riddle service:
+        /riddles?term=<term>[&k=<k>] - Riddles for an agglutinated term
+        /top[?k=<k>] - Best scored riddles
+        /random[?k=<k>&seed=<seed>] - Riddles drawn weighted by exp(Score)
+        /metrics - Request latencies and cache hits
+    '''
+
+    def do_GET(self) -> None:
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        endpoint = url.path.strip('/')
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        status = 200
+        if endpoint not in RiddleService.endpoints:
+            status, body = 404, json.dumps({'error': 'Unknown endpoint'})
+        else:
+            try:
+                body = self.server.service.query(endpoint, params)
+            except ValueError as error:
+                status, body = 400, json.dumps({'error': str(error)})
+            except Exception:
+                logger.exception(f'Error answering \'{self.path}\'')
+                status = 500
+                body = json.dumps({'error': 'Internal server error'})
+
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if endpoint in RiddleService.endpoints:
+            self.server.service.record(endpoint, time.perf_counter() - start,
+                                       status != 200)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return 'unix'
+
+    def log_message(self, format, *args) -> None:
+        logger.debug(f'{self.address_string()} - {format % args}')
+
+
+class PoolMixIn(object):
+    '''
+    Handles each request in a fixed pool of worker threads.
+    '''
+
+    def init_pool(self, service: RiddleService, workers: int) -> None:
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address) -> None:
+        self.executor.submit(self.process_request_thread,
+                             request, client_address)
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class PooledHTTPServer(PoolMixIn, HTTPServer):
+    pass
+
+
+if unix_sockets:
+    class PooledUnixHTTPServer(PoolMixIn, socketserver.UnixStreamServer):
+        def server_close(self) -> None:
+            super().server_close()
+            Path(self.server_address).unlink(missing_ok=True)
+
+
+def make_server(service: RiddleService, host: str = '127.0.0.1',
+                port: int = 8000, socket_path: Path = None,
+                workers: int = 4):
+    '''
+    Creates a server answering with `service` through `workers` threads,
+    listening on `socket_path` if given, or on `host`:`port` otherwise.
+    '''
+    if socket_path is not None:
+        if not unix_sockets:
+            raise ValueError('Unix sockets are not available on this '
+                             'platform')
+        server = PooledUnixHTTPServer(str(socket_path), RiddleRequestHandler)
+        server.address = f'unix:{socket_path}'
+    else:
+        server = PooledHTTPServer((host, port), RiddleRequestHandler)
+        server.address = f'http://{host}:{server.server_address[1]}'
+    server.init_pool(service, workers)
+    return server
@@ -0,0 +1,184 @@
+import gzip
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import pandas as pd
+
+from seco.profiling import profiled
+
+logger = logging.getLogger('riddles')
+
+formats = ['json', 'ndjson', 'csv', 'parquet']
+compressions = ['gzip', 'zstd']
+format_suffixes = {'.json': 'json',
+                   '.ndjson': 'ndjson',
+                   '.jsonl': 'ndjson',
+                   '.csv': 'csv',
+                   '.parquet': 'parquet'}
+compression_suffixes = {'.gz': 'gzip',
+                        '.zst': 'zstd'}
+
+
+class ResultWriter(ABC):
+    '''
+    Writes result DataFrames to a file as they are produced. Each call to
+    `write` appends the records of a DataFrame, `batch_size` rows at a time,
+    so only one batch is rendered in memory at once. Formats implement
+    `write_batch`.
+    '''
+
+    def __init__(self, filepath: Path, compression: str = None,
+                 batch_size: int = 10000) -> None:
+        self.filepath = filepath
+        self.compression = compression
+        self.batch_size = batch_size
+        self.rows = 0
+        self.file_ = None
+        # Columns to write the header or schema of, if no record is written
+        self.empty_frame = None
+
+    def open_text(self):
+        if self.compression == 'gzip':
+            return gzip.open(self.filepath, 'wt', encoding='utf-8')
+        elif self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError as error:
+                raise ImportError('zstd compression requires the '
+                                  '\'zstandard\' package') from error
+            return zstandard.open(self.filepath, 'wt', encoding='utf-8')
+        return self.filepath.open('w', encoding='utf-8')
+
+    @profiled('write')
+    def write(self, df: pd.DataFrame) -> None:
+        if df.shape[0] == 0:
+            self.empty_frame = df
+        for start in range(0, df.shape[0], self.batch_size):
+            batch = df.iloc[start:start + self.batch_size]
+            self.write_batch(batch)
+            self.rows += batch.shape[0]
+
+    @abstractmethod
+    def write_batch(self, df: pd.DataFrame) -> None:
+        '''
+        Writes a batch of records, opening the file on the first one.
+        '''
+
+    def close(self) -> None:
+        if self.file_ is None and self.empty_frame is not None:
+            self.write_batch(self.empty_frame)
+        if self.file_ is not None:
+            self.file_.close()
+        logger.info(f'Wrote {self.rows} records to \'{self.filepath}\'')
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class JSONWriter(ResultWriter):
+    '''
+    Writes a single indented JSON array of records, as
+    `DataFrame.to_json(orient='records', indent=4)` does.
+    '''
+
+    def write_batch(self, df: pd.DataFrame) -> None:
+        records = df.to_json(orient='records', indent=4, force_ascii=False)
+        # Strip the enclosing brackets to continue the same array
+        records = records.strip()[1:-1].strip('\n')
+        if self.file_ is None:
+            self.file_ = self.open_text()
+            self.file_.write('[\n')
+        if self.rows > 0:
+            self.file_.write(',\n')
+        self.file_.write(records)
+
+    def close(self) -> None:
+        if self.file_ is None:
+            self.file_ = self.open_text()
+            self.file_.write('[')
+        self.file_.write('\n]')
+        super().close()
+
+
+class NDJSONWriter(ResultWriter):
+    '''
+    Writes one JSON record per line.
+    '''
+
+    def write_batch(self, df: pd.DataFrame) -> None:
+        if self.file_ is None:
+            self.file_ = self.open_text()
+        records = df.to_json(orient='records', lines=True, force_ascii=False)
+        if records.strip():
+            self.file_.write(records.rstrip('\n') + '\n')
+
+
+class CSVWriter(ResultWriter):
+    '''
+    Writes a CSV file with a header row taken from the first batch.
+    '''
+
+    def write_batch(self, df: pd.DataFrame) -> None:
+        header = self.file_ is None
+        if header:
+            self.file_ = self.open_text()
+        df.to_csv(self.file_, header=header, index=False)
+
+
+class ParquetWriter(ResultWriter):
+    '''
+    Writes a Parquet file with one row group per batch. The schema is taken
+    from the first batch. Requires `pyarrow`.
+    '''
+
+    def write_batch(self, df: pd.DataFrame) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise ImportError('Parquet output requires the '
+                              '\'pyarrow\' package') from error
+
+        if self.file_ is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self.file_ = pq.ParquetWriter(self.filepath, table.schema,
+                                          compression=self.compression or
+                                          'snappy')
+        else:
+            table = pa.Table.from_pandas(df, schema=self.file_.schema,
+                                         preserve_index=False)
+        self.file_.write_table(table)
+
+
+writers = {'json': JSONWriter,
+           'ndjson': NDJSONWriter,
+           'csv': CSVWriter,
+           'parquet': ParquetWriter}
+
+
+def open_writer(filepath: Path, format_: str = None,
+                compression: str = None, **kwargs) -> ResultWriter:
+    '''
+    Opens a result writer for `filepath`. When not given, the format and the
+    compression are inferred from the file suffixes (e.g. `results.ndjson.gz`).
+    Parquet files use the compression as their internal codec.
+    '''
+    suffixes = [s.lower() for s in filepath.suffixes]
+    if suffixes and suffixes[-1] in compression_suffixes:
+        suffix_compression = compression_suffixes[suffixes.pop()]
+        if compression is None:
+            compression = suffix_compression
+    if format_ is None:
+        if not suffixes or suffixes[-1] not in format_suffixes:
+            raise ValueError(f'Unable to infer output format of '
+                             f'\'{filepath}\', choose one of {formats}')
+        format_ = format_suffixes[suffixes[-1]]
+    if format_ not in writers:
+        raise ValueError(f'Unknown output format \'{format_}\'')
+    if compression is not None and compression not in compressions:
+        raise ValueError(f'Unknown compression \'{compression}\'')
+    return writers[format_](filepath, compression=compression, **kwargs)